@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+async_client -- asynchronous LDAP client multiplexing many operations on a connection.
+
+Operations return a Future at once, results of all connections are read by
+the dispatcher thread of a Loop when their sockets are readable, so a single
+process keeps thousands of operations in flight with a handful of threads.
+
+@author:     FengXi
+"""
+
+import collections
+import logging
+import os
+import select
+import threading
+import time
+
+import ldap
+import ldap.modlist as modlist
+import ldap_client
+import stats
+
+logger = logging.getLogger("async_client")
+
+# python-ldap 3 tells the msgid of an error result, so the results of any
+# msgid are read at once. python-ldap 2 polls every msgid in flight.
+_ERRORS_HAVE_MSGID = int(ldap.__version__.split('.')[0]) >= 3
+
+
+class Future(object):
+    """The result of an asynchronous operation"""
+
+    def __init__(self, op, dn=None):
+        self.op = op
+        self.dn = dn
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "op=%s,dn=%s,done=%s" % (self.op, self.dn, self.done())
+
+    __repr__ = __str__
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """wait for the result data, raise the LDAPError if the operation failed"""
+        if not self._done.wait(timeout):
+            raise ldap.TIMEOUT("%s on %s is not done in %s seconds." % (self.op, self.dn, timeout))
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+    def exception(self, timeout=None):
+        """wait for the operation, return its LDAPError or None"""
+        if not self._done.wait(timeout):
+            raise ldap.TIMEOUT("%s on %s is not done in %s seconds." % (self.op, self.dn, timeout))
+
+        return self._error
+
+    def add_done_callback(self, fn):
+        """call fn(future) once the operation is done, on the loop thread"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def _set(self, result=None, error=None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception("error in callback of %s.", self)
+
+
+def gather(futures):
+    """wait for all futures, return their results, raise the error of the first one failed"""
+    return [f.result() for f in futures]
+
+
+class Loop(object):
+    """A dispatcher thread reading the results of many asynchronous clients
+
+    Clients with operations in flight are polled when their sockets are
+    readable, or every poll_interval seconds for data buffered by TLS.
+    """
+
+    def __init__(self, poll_interval=0.05):
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._stopped = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, client):
+        with self._lock:
+            self._clients.add(client)
+
+    def remove(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def wake(self):
+        """wake the dispatcher up, e.g. a client has a new socket to watch"""
+        os.write(self._wakeup_w, 'x')
+
+    def stop(self):
+        self._stopped = True
+        self.wake()
+        self._thread.join()
+
+    def _run(self):
+        # clients whose last poll got results, libldap may hold more of them
+        # read off the socket already.
+        again = set()
+        while not self._stopped:
+            with self._lock:
+                clients = [c for c in self._clients if c.pending()]
+
+            fds = {}
+            for c in clients:
+                fileno = c.fileno()
+                if fileno is not None:
+                    fds[fileno] = c
+
+            try:
+                readable = self._select(fds.keys() + [self._wakeup_r], 0 if again else self.poll_interval)
+            except (select.error, IOError, OSError) as e:
+                # a socket closed in the middle, watch the remaining ones.
+                logger.debug("error during select: %s", e)
+                readable = []
+
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 4096)
+
+            polled = set(fds[r] for r in readable if r in fds) | again.intersection(clients)
+            if not readable and not again:
+                # nothing readable for a poll interval, results may be buffered by TLS.
+                polled = clients
+
+            again = set()
+            for c in polled:
+                try:
+                    if c._poll():
+                        again.add(c)
+                except Exception:
+                    # the dispatcher serves all clients, it must not die with one of them.
+                    logger.exception("error polling %s.", c)
+
+    def _select(self, fds, timeout):
+        if hasattr(select, 'poll'):
+            # select.select does not support fd >= FD_SETSIZE, i.e. thousands of connections.
+            poller = select.poll()
+            for fd in fds:
+                poller.register(fd, select.POLLIN | select.POLLPRI)
+            return [fd for fd, _ in poller.poll(timeout * 1000)]
+
+        readable, _, _ = select.select(fds, [], [], timeout)
+        return readable
+
+
+_default_loop = None
+_default_loop_lock = threading.Lock()
+
+
+def default_loop():
+    """the Loop shared by clients created without one"""
+    global _default_loop
+
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = Loop()
+        return _default_loop
+
+
+class AsyncClient(object):
+    """Asynchronous LDAP client
+
+    bind, search, add, modify and delete send a request and return a Future
+    of its result data, many of them can be in flight on the connection.
+    """
+
+    def __init__(self, server=ldap_client.DEFAULT_SERVER, loop=None, metrics=None,
+                 trace_level=ldap_client.DEFAULT_TRACE_LEVEL):
+        self.server = server
+        self.loop = loop or default_loop()
+        self.metrics = metrics
+        self.trace_level = trace_level
+
+        self._conn = None
+        self._lock = threading.Lock()
+        # msgid -> (future, start), oldest first
+        self._pending = collections.OrderedDict()
+
+    def __str__(self):
+        return "%s,pending=%s" % (self.server, len(self._pending))
+
+    __repr__ = __str__
+
+    def connect(self, trace_file=None):
+        """Connect to a LDAP server, the connection is opened by the first operation."""
+        logger.debug("connect to %s", self.server)
+        # blind trust all certs for test purpose.
+        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+
+        if trace_file is None:
+            self._conn = ldap.initialize(uri=self.server.uri, trace_level=self.trace_level)
+        else:
+            self._conn = ldap.initialize(uri=self.server.uri, trace_level=self.trace_level, trace_file=trace_file)
+        self.loop.add(self)
+
+    def connect_bind(self, account=ldap_client.DEFAULT_ACCOUNT):
+        """Connect to a LDAP server and bind, return the Future of the bind."""
+        self.connect()
+        return self.bind(account)
+
+    def close(self):
+        """unbind the connection, operations in flight are abandoned"""
+        self.loop.remove(self)
+
+        # the loop thread may be polling the connection, it skips a closed one
+        # and a result of an operation failed here.
+        conn, self._conn = self._conn, None
+        self._fail_all(ldap.SERVER_DOWN("connection closed."))
+
+        if conn:
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError as e:
+                logger.debug("error during unbind: %s", e)
+
+    def _fail_all(self, error):
+        """fail all operations in flight"""
+        with self._lock:
+            pending = self._pending.values()
+            self._pending.clear()
+
+        for future, start in pending:
+            self._finish(future, start, error=error)
+
+    def pending(self):
+        """# of operations in flight"""
+        return len(self._pending)
+
+    def fileno(self):
+        """the socket of the connection, None if it's not open yet"""
+        if self._conn is None:
+            return None
+
+        try:
+            fd = self._conn.get_option(ldap.OPT_DESC)
+        except ldap.LDAPError:
+            return None
+
+        return fd if fd is not None and fd >= 0 else None
+
+    def _submit(self, op, dn, send):
+        future = Future(op, dn)
+        start = self.metrics.start(op, dn) if self.metrics else time.time()
+
+        with self._lock:
+            try:
+                msgid = send(self._conn)
+            except ldap.LDAPError as e:
+                self._finish(future, start, error=e)
+                return future
+
+            self._pending[msgid] = (future, start)
+
+        # the socket is opened by the first operation
+        self.loop.wake()
+        return future
+
+    def _finish(self, future, start, result=None, error=None):
+        if self.metrics:
+            self.metrics.finish(future.op, future.dn, start, type(error).__name__ if error else stats.SUCCESS)
+        future._set(result, error)
+
+    def _poll(self):
+        """collect the results of operations done, on the loop thread
+
+        Returns:
+            True if any operation is done
+        """
+        conn = self._conn
+        if conn is None:
+            # closed
+            return False
+
+        if _ERRORS_HAVE_MSGID:
+            return self._poll_any(conn)
+
+        return self._poll_each(conn)
+
+    def _poll_any(self, conn):
+        """read the results of any msgid until none is done"""
+        done = False
+        while self._pending:
+            try:
+                rtype, rdata, msgid, _ = conn.result3(ldap.RES_ANY, all=1, timeout=0)
+            except ldap.LDAPError as e:
+                info = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+                if info.get('msgid') is None:
+                    # not a result of an operation, e.g. the connection is lost.
+                    self._fail_all(e)
+                    return True
+                self._resolve(info['msgid'], error=e)
+            else:
+                if rtype is None:
+                    break
+                self._resolve(msgid, result=rdata)
+
+            done = True
+
+        return done
+
+    def _poll_each(self, conn):
+        """poll every msgid in flight, an error result of any msgid could not be told apart by python-ldap 2"""
+        with self._lock:
+            pending = self._pending.keys()
+
+        done = False
+        for msgid in pending:
+            try:
+                rtype, rdata, _, _ = conn.result3(msgid, all=1, timeout=0)
+            except ldap.LDAPError as e:
+                done = self._resolve(msgid, error=e) or done
+                continue
+
+            if rtype is not None:
+                done = self._resolve(msgid, result=rdata) or done
+
+        return done
+
+    def _resolve(self, msgid, result=None, error=None):
+        """finish an operation in flight, False if it's not, e.g. failed by close"""
+        with self._lock:
+            pending = self._pending.pop(msgid, None)
+
+        if pending is None:
+            return False
+
+        future, start = pending
+        self._finish(future, start, result, error)
+        return True
+
+    def bind(self, account=ldap_client.DEFAULT_ACCOUNT):
+        return self._submit('bind', account.dn, lambda conn: conn.simple_bind(account.dn, account.password))
+
+    def search(self, base, scope=ldap.SCOPE_ONELEVEL, filterstr='(objectClass=*)', attrlist=None):
+        """search, the result data is a list of (dn, attrs) entries"""
+        return self._submit('search', base, lambda conn: conn.search_ext(base, scope, filterstr, attrlist))
+
+    def add(self, dn, attrs):
+        """add an entry, see ldap_client.Client.add_entry"""
+        return self._submit('add', dn, lambda conn: conn.add_ext(dn, modlist.addModlist(attrs)))
+
+    def modify(self, dn, mods):
+        """modify an entry with a modlist of (op, attr_name, attr_val) tuples"""
+        return self._submit('modify', dn, lambda conn: conn.modify_ext(dn, mods))
+
+    def delete(self, dn):
+        return self._submit('delete', dn, lambda conn: conn.delete_ext(dn))
+
+    def add_entries(self, entries, window=ldap_client.DEFAULT_WINDOW):
+        """add many entries with up to `window` adds in flight, see ldap_client.Client.add_entries
+
+        Returns:
+            a list of (dn, error) tuples for the entries failed to add
+        """
+        cond = threading.Condition()
+        inflight = [0]
+        failures = []
+
+        def _done(future):
+            with cond:
+                if future.exception() is not None:
+                    failures.append((future.dn, future.exception()))
+                inflight[0] -= 1
+                cond.notify()
+
+        def _wait(limit):
+            with cond:
+                while inflight[0] > limit:
+                    cond.wait()
+
+        for entry in entries:
+            if entry is None:
+                _wait(0)
+                continue
+
+            _wait(max(1, window) - 1)
+
+            with cond:
+                inflight[0] += 1
+            dn, attrs = entry
+            self.add(dn, attrs).add_done_callback(_done)
+
+        _wait(0)
+
+        return failures
+
+
+if __name__ == "__main__":
+    pass
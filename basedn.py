@@ -6,17 +6,49 @@ Created on Sep 1, 2016
 @author: FengXi
 """
 
+import functools
+import re
+
 import ldap.dn as dn
+import ldap.filter
 
 RESERVED_TENANT = "example"
 
+# characters escape_dn_chars escapes, most values have none of them
+_DN_SPECIAL = re.compile(r'[,=+<>#;\\"\x00]|^ | $')
+
 def escape(val):
     """safely escape ldap dn"""
+    if not _DN_SPECIAL.search(val):
+        return val
     return dn.escape_dn_chars(val)
 
+def _memoized(fn):
+    """cache the result of a function of a tenant, bases are built once per tenant"""
+    cache = {}
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        base = cache.get(args)
+        if base is None:
+            base = cache[args] = fn(*args)
+        return base
+
+    return wrapper
+
+def escape_filter(val):
+    """safely escape an assertion value of ldap filter"""
+    return ldap.filter.escape_filter_chars(val)
+
+def or_filter(attr, vals):
+    """(|(attr=val1)(attr=val2)...), values are escaped"""
+    return "(|%s)" % ''.join("(%s=%s)" % (attr, escape_filter(v)) for v in vals)
+
+@_memoized
 def tenant_base(tenant_name=RESERVED_TENANT):
     return "dc=%s,dc=com" % (escape(tenant_name))
 
+@_memoized
 def people_base(tenant_name):
     return "ou=people," + tenant_base(tenant_name)
 
@@ -26,7 +58,13 @@ def subject_base(tenant_name):
 def people_dn(username, tenant_name=RESERVED_TENANT):
     return "uid=%s," % (escape(username)) + people_base(tenant_name)
 
+def people_dns(usernames, tenant_name=RESERVED_TENANT):
+    """dns of many users of a tenant"""
+    suffix = "," + people_base(tenant_name)
+    return ["uid=" + escape(u) + suffix for u in usernames]
+
 
+@_memoized
 def org_base(tenant_name):
     return "ou=organization," + tenant_base(tenant_name)
 
@@ -46,5 +84,28 @@ def v2_org_dn(tenant_name, *names):
     return ','.join(rdns)
 
 
+def v2_org_dns(tenant_name, paths):
+    """dns of many organizations of a tenant
+
+    Args:
+        paths: names of every organization from the top, e.g. ('a', 'b') for cn=b,cn=a
+    """
+    suffix = org_base(tenant_name)
+    return [','.join(["cn=%s" % escape(p) for p in reversed(path)] + [suffix]) for path in paths]
+
+
+def parse(dn_str):
+    """parse a dn into a tuple of RDNs, an RDN is a tuple of (attr, value), values are unescaped
+
+    For example: cn=R\\,D,ou=organization -> ((('cn', 'R,D'),), (('ou', 'organization'),))
+    """
+    return tuple(tuple((attr, val) for attr, val, _ in rdn) for rdn in dn.str2dn(dn_str))
+
+
+def parent(dn_str):
+    """the dn of the parent of a dn, the empty string for a top entry"""
+    return dn.dn2str(dn.str2dn(dn_str)[1:])
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench -- mixed-workload directory benchmark
+
+Workers replay a weighted mix of operations against the sampled users of a
+tenant for a fixed duration, after a warmup whose operations are not
+counted. The same mix is run at every concurrency level.
+
+@author:     FengXi
+"""
+
+import bisect
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+import basedn
+import identity
+import ldap
+import ldap.dn
+import ldap_client
+import login
+import organization
+import stats
+import subject
+import tenant
+from argparse import ArgumentParser
+from argparse import ArgumentDefaultsHelpFormatter
+
+logger = logging.getLogger("bench")
+
+# bind as a user on a connection of its own
+BIND = "bind"
+# exists_user of a user
+EXISTS = "exists"
+# search_entry_uuid of a user
+UUID = "uuid"
+# search the groupOfUniqueNames a user is a member of
+MEMBER = "member"
+# replace_one_attr of a user
+MODIFY = "modify"
+# create a user, add_one_attr to it, then delete it
+CHURN = "churn"
+
+OPERATIONS = (BIND, EXISTS, UUID, MEMBER, MODIFY, CHURN)
+DEFAULT_MIX = "bind=30,exists=20,uuid=20,member=10,modify=10,churn=10"
+
+
+def parse_mix(text):
+    """parse op=weight,... into a list of (op, weight) tuples"""
+    mix = []
+    for part in text.split(','):
+        op, _, weight = part.strip().partition('=')
+        if op not in OPERATIONS:
+            raise ValueError("unknown operation %s, expect one of %s." % (op, ', '.join(OPERATIONS)))
+        if float(weight or 1) > 0:
+            mix.append((op, float(weight or 1)))
+
+    if not mix:
+        raise ValueError("empty operation mix %s." % text)
+
+    return mix
+
+
+class Workload(object):
+    """operations of a worker, each worker has its own connections"""
+
+    def __init__(self, server, account, tenant_name, users, trace_level=0, worker=0):
+        self.tenant = tenant_name
+        self.users = users
+        self.worker = worker
+        self.rng = random.Random()
+
+        self.metrics = stats.Metrics()
+        self.client = ldap_client.Client(server, metrics=self.metrics, trace_level=trace_level)
+        self.client.connect_bind(account)
+        # binds as users must not change the identity of the other operations
+        self.bind_client = ldap_client.Client(server, metrics=self.metrics, trace_level=trace_level)
+        self.bind_client.connect()
+
+        self._s_crud = subject.CRUD(self.client)
+        self._churned = 0
+
+    def close(self):
+        login._close(self.client)
+        login._close(self.bind_client)
+
+    def run(self, op):
+        """run an operation, raise LDAPError if it fails"""
+        getattr(self, "_" + op)()
+
+    def _dn(self):
+        return self.users.pick(self.rng).dn
+
+    def _bind(self):
+        self.bind_client.bind(self.users.pick(self.rng))
+
+    def _exists(self):
+        username = ldap.dn.str2dn(self._dn())[0][0][1]
+        if not self.client.exists_user(self.tenant, username):
+            raise ldap.NO_SUCH_OBJECT({'desc': "No such object", 'info': username})
+
+    def _uuid(self):
+        dn = self._dn()
+        if self.client.search_entry_uuid(dn) is None:
+            raise ldap.NO_SUCH_OBJECT({'desc': "No such object", 'info': dn})
+
+    def _member(self):
+        filterstr = '(&(objectClass=groupOfUniqueNames)(uniqueMember=%s))' % basedn.escape_filter(self._dn())
+        r = self.client.search(basedn.org_base(self.tenant), scope=ldap.SCOPE_SUBTREE, filterstr=filterstr,
+                               attrlist=["cn"])
+        if r is None:
+            raise ldap.OPERATIONS_ERROR({'desc': "search failed", 'info': filterstr})
+
+    def _modify(self):
+        self.client.replace_one_attr(self._dn(), 'telephoneNumber', "010%08d" % self.rng.randint(0, 99999999))
+
+    def _churn(self):
+        self._churned += 1
+        username = "bench.%s.%s.%s" % (self.worker, self._churned, self.rng.randint(0, 0xffffffff))
+        people = subject.People(username, "Bench", "Churn")
+
+        self._s_crud.create(self.tenant, people)
+        try:
+            self.client.add_one_attr(people.dn(self.tenant), 'description', "churn")
+        finally:
+            self._s_crud.delete(username, self.tenant)
+
+
+def _worker(workload, mix, warmup_end, deadline, stop, metrics):
+    """run weighted random operations until the deadline, those after warmup_end are recorded to metrics"""
+    ops = [op for op, _ in mix]
+    cumulative = []
+    total = 0.0
+    for _, weight in mix:
+        total += weight
+        cumulative.append(total)
+
+    rng = workload.rng
+    warmup = stats.Metrics()
+    while not stop.is_set():
+        start = time.time()
+        if start >= deadline:
+            break
+
+        op = ops[bisect.bisect_left(cumulative, rng.random() * total)]
+        code = stats.SUCCESS
+        try:
+            workload.run(op)
+        except ldap.LDAPError as e:
+            code = type(e).__name__
+            logger.debug("%s failed: %s", op, e)
+
+        (metrics if start >= warmup_end else warmup).record(op, time.time() - start, code)
+
+
+def run(server, account, tenant_name, users, mix, concurrency=1, warmup=10, duration=60,
+        trace_level=0):
+    """run the mix with `concurrency` worker threads
+
+    Args:
+        users: a login.CredentialPool of the users to operate on
+        mix: a list of (op, weight) tuples, see parse_mix
+        warmup: seconds to run before the operations are recorded
+        duration: seconds to record
+
+    Returns:
+        a dict of the results
+    """
+    workloads = [Workload(server, account, tenant_name, users, trace_level=trace_level, worker=idx)
+                 for idx in range(0, concurrency)]
+    metrics = [stats.Metrics() for _ in workloads]
+
+    stop = threading.Event()
+    start = time.time()
+    warmup_end = start + warmup
+    deadline = warmup_end + duration
+
+    threads = []
+    for w, m in zip(workloads, metrics):
+        t = threading.Thread(target=_worker, args=(w, mix, warmup_end, deadline, stop, m))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    elapsed = max(0.0, min(time.time(), deadline) - warmup_end)
+
+    total = stats.Metrics()
+    client = stats.Metrics()
+    for w, m in zip(workloads, metrics):
+        total.merge(m)
+        client.merge(w.metrics)
+        w.close()
+
+    operations = total.to_dict()
+    count = sum(s['count'] for s in operations.itervalues())
+    errors = sum(s['errors'] for s in operations.itervalues())
+
+    return {
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'count': count,
+        'errors': errors,
+        'throughput': count / elapsed if elapsed else 0,
+        'operations': operations,
+        # every LDAP request of the operations, warmup included
+        'client': client.to_dict(),
+    }
+
+
+def seed_mock(server, account, tenant_name, prefix, count, max_members=10):
+    """create a tenant, `count` users prefix.0 .. and some organizations in the mock directory
+
+    :return: list of dn of the users
+    """
+    client = ldap_client.Client(server, trace_level=0)
+    client.connect_bind(account)
+    try:
+        tenant.CRUD(client).create(tenant_name)
+        user_dns = subject.CRUD(client).sample(tenant_name, count=count, prefix=prefix,
+                                               identities=identity.Generator(["Bench"], ["User"], ["bench"]))
+        organization.CRUD(client).sample(tenant_name, organization.OrgTree.synthetic(2, 5), user_dns,
+                                         max_members=max_members)
+        return user_dns
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    """Command line options."""
+
+    if argv is None:
+        argv = sys.argv
+    else:
+        sys.argv.extend(argv)
+
+    # add command line options/parser
+    parser = ArgumentParser(description="mixed-workload directory benchmark.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--uri", help="LDAP URI. For example: ldaps://localhost:1636", default="ldap://localhost:1389")
+    parser.add_argument("-D", "--bindDN", help="DN to use to bind to the server.", default="cn=admin,dc=example,dc=com")
+    parser.add_argument("-w", "--bindPassword", help="Password to use to bind to the server.", default="admin")
+
+    parser.add_argument("--mix", help="weights of the operations, of %s." % ', '.join(OPERATIONS), default=DEFAULT_MIX)
+    parser.add_argument("-n", "--concurrency", help="comma separated concurrency levels, each one is a run.",
+                        default="1")
+    parser.add_argument("--warmup", help="seconds to run before recording every run.", type=float, default=10)
+    parser.add_argument("--duration", help="seconds to record every run.", type=float, default=60)
+    parser.add_argument("--json", help="write the results as JSON to the file, - for stdout.")
+
+    # users to operate on, sampled by sampler.py
+    parser.add_argument("--dn-file", help="operate on users listed in the file, one dn per line, "
+                                          "as written by sampler.py --dn-file.")
+    parser.add_argument("--prefix", help="operate on users prefix.0 .. prefix.(range - 1) sampled by "
+                                         "sampler.py --prefix.", default="test")
+    parser.add_argument("--range", type=int, default=1000, help="# of users of --prefix.")
+    parser.add_argument("--tenant", default=basedn.RESERVED_TENANT, help="tenant of the users.")
+    parser.add_argument("--password", default="1", help="password of the users.")
+    parser.add_argument("--access", choices=(login.UNIFORM, login.ZIPF), default=login.UNIFORM,
+                        help="how users are picked.")
+
+    parser.add_argument("--mock", help="run against an in-process mock directory seeded with --range users "
+                                       "of --prefix, instead of --uri.", action="store_true", default=False)
+    parser.add_argument("--mock-latency", help="milliseconds every operation of --mock takes.", type=float,
+                        default=0)
+
+    parser.add_argument("--trace-level", type=int, default=0, help="python-ldap trace level.")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="WARNING",
+                        help="log level.")
+
+    # parse arguments
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    mix = parse_mix(args.mix)
+    levels = [int(n) for n in args.concurrency.split(',')]
+
+    ldap_server = ldap_client.Server(None, None, args.uri)
+    ldap_account = ldap_client.Account(args.bindDN, args.bindPassword)
+
+    if args.mock:
+        import mockldap
+
+        mockldap.install(mockldap.Directory(root_dn=args.bindDN, root_password=args.bindPassword,
+                                            latency=args.mock_latency / 1000.0))
+        dns = seed_mock(ldap_server, ldap_account, args.tenant, args.prefix, args.range)
+    elif args.dn_file:
+        dns = [line.strip() for line in open(args.dn_file, 'r') if line.strip()]
+    else:
+        dns = basedn.people_dns(("%s.%s" % (args.prefix, idx) for idx in xrange(0, args.range)), args.tenant)
+
+    users = login.CredentialPool(dns, password=args.password, access=args.access)
+
+    runs = []
+    for n in levels:
+        result = run(ldap_server, ldap_account, args.tenant, users, mix, concurrency=n, warmup=args.warmup,
+                     duration=args.duration, trace_level=args.trace_level)
+        runs.append(result)
+
+        print "concurrency: %s, operations: %s, errors: %s, throughput: %.1f ops/s" % (
+            n, result['count'], result['errors'], result['throughput'])
+        for op, s in sorted(result['operations'].iteritems()):
+            ok = s['codes'].get(stats.SUCCESS)
+            print "  %s: count=%s errors=%s%s" % (op, s['count'], s['errors'],
+                                                 " p50=%.3fms p99=%.3fms" % (ok['p50_ms'], ok['p99_ms']) if ok else "")
+
+    if args.json:
+        report = json.dumps({'mix': dict(mix), 'warmup': args.warmup, 'duration': args.duration,
+                             'users': len(users), 'mock': args.mock, 'runs': runs}, sort_keys=True, indent=2)
+        if args.json == '-':
+            print report
+        else:
+            with open(args.json, 'w') as out:
+                out.write(report + '\n')
+
+    return 1 if any(r['errors'] for r in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
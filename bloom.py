@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bloom -- a compact Bloom filter
+
+@author:     FengXi
+"""
+
+import hashlib
+import math
+
+
+class BloomFilter(object):
+    """A Bloom filter of strings.
+
+    A member is never reported absent, a non-member is reported present with
+    probability of about `error_rate` once `capacity` members are added.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(float(self.bits) / capacity * math.log(2))))
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        # double hashing, see Kirsch & Mitzenmacher, "Less Hashing, Same Performance"
+        digest = hashlib.md5(key).hexdigest()
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:], 16) | 1
+
+        for i in xrange(0, self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self._array[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+    def __str__(self):
+        return "bits=%s,hashes=%s" % (self.bits, self.hashes)
+
+    __repr__ = __str__
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+cache -- a size bounded LRU cache with TTL
+
+@author:     FengXi
+"""
+
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """A thread-safe LRU cache of at most maxsize entries, an entry expires ttl seconds after it's put."""
+
+    def __init__(self, maxsize=100000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # key -> (expiry, value), least recently used first
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "size=%s,hits=%s,misses=%s" % (len(self._entries), self.hits, self.misses)
+
+    __repr__ = __str__
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return default
+
+            # most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+if __name__ == "__main__":
+    pass
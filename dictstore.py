@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+dictstore -- memory-mapped sample dictionaries
+
+@author:     FengXi
+"""
+
+import array
+import logging
+import mmap
+import os
+
+import identity
+
+logger = logging.getLogger("dictstore")
+
+# suffix of the line offset index cached next to a dictionary file
+INDEX_SUFFIX = ".idx"
+
+# magic of the first line of an index file
+_INDEX_MAGIC = "ldaputil-dict-index"
+
+
+class Dictionary(object):
+    """A dictionary file of one word per line, optionally followed by a frequency column
+
+    The file is memory-mapped and words are read by their line offsets on
+    access, instead of loading every word into a string up front. The offset
+    index is built once and cached on disk next to the file. A Dictionary can
+    be used as the choices of an identity.Generator.
+    """
+
+    def __init__(self, path, transform=None):
+        self.path = path
+        self.transform = transform
+
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # an empty file can't be memory-mapped
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else ''
+        self._offsets = self._load_index()
+
+    def __str__(self):
+        return "%s,words=%s" % (self.path, len(self._offsets))
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, idx):
+        word = self._line(self._offsets[idx]).split(None, 1)[0]
+        return self.transform(word) if self.transform else word
+
+    def __iter__(self):
+        for idx in xrange(0, len(self._offsets)):
+            yield self[idx]
+
+    def _line(self, start):
+        end = self._mmap.find('\n', start)
+        if end < 0:
+            end = len(self._mmap)
+
+        return self._mmap[start:end]
+
+    def weights(self):
+        """frequency of every word, a ValueError is raised if a line has no frequency column"""
+        try:
+            return [identity.weight(self._line(start).split()) for start in self._offsets]
+        except ValueError as e:
+            raise ValueError("%s: %s" % (self.path, e))
+
+    def _header(self):
+        st = os.stat(self.path)
+        return "%s %s %r\n" % (_INDEX_MAGIC, st.st_size, st.st_mtime)
+
+    def _load_index(self):
+        """load the cached index, or build it if it's missing or stale"""
+        index_path = self.path + INDEX_SUFFIX
+        header = self._header()
+
+        try:
+            with open(index_path, 'rb') as f:
+                if f.readline() == header:
+                    typecode = f.read(1)
+                    count = int(f.readline())
+                    offsets = array.array(typecode)
+                    offsets.fromfile(f, count)
+                    return offsets
+        except (IOError, ValueError, EOFError) as e:
+            logger.debug("failed to load index %s: %s", index_path, e)
+
+        offsets = self._build_index()
+
+        # a read only dictionary directory only costs a rebuild on every run.
+        tmp_path = "%s.%s" % (index_path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(offsets.typecode)
+                f.write("%s\n" % len(offsets))
+                offsets.tofile(f)
+            os.rename(tmp_path, index_path)
+        except (IOError, OSError) as e:
+            logger.info("failed to cache index %s: %s", index_path, e)
+
+        return offsets
+
+    def _build_index(self):
+        """offsets of all non blank lines"""
+        size = len(self._mmap)
+        offsets = array.array('I' if size < 2 ** 32 else 'L')
+
+        start = 0
+        while start < size:
+            end = self._mmap.find('\n', start)
+            if end < 0:
+                end = size
+
+            if self._mmap[start:end].strip():
+                offsets.append(start)
+
+            start = end + 1
+
+        return offsets
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    pass
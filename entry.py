@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+entry -- compact LDAP entries
+
+An Entry holds its values in a tuple, in the order of the attribute names
+of its Layout. Entries of a result set share one Layout, whose names are
+interned, instead of a dict of lists each. A single value is stored as is,
+values are only turned into lists or decoded when they're read.
+
+@author:     FengXi
+"""
+
+import threading
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+class Layout(object):
+    """attribute names shared by many entries"""
+
+    __slots__ = ('names', '_index')
+
+    def __init__(self, names):
+        self.names = tuple(intern(n) for n in names)
+        self._index = dict((n.lower(), idx) for idx, n in enumerate(self.names))
+
+    def index(self, name):
+        """index of an attribute name, case insensitive, None if it's not in the layout"""
+        return self._index.get(name.lower())
+
+    def __len__(self):
+        return len(self.names)
+
+    def __str__(self):
+        return ','.join(self.names)
+
+    __repr__ = __str__
+
+
+def layout(names):
+    """the shared Layout of the attribute names"""
+    names = tuple(names)
+
+    l = _layouts.get(names)
+    if l is None:
+        with _layouts_lock:
+            l = _layouts.setdefault(names, Layout(names))
+
+    return l
+
+
+def _pack(values):
+    """a single value as is, many values as a tuple, None for no value"""
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return tuple(values)
+
+
+def _decode(val):
+    """a value as unicode, values are UTF-8 encoded"""
+    return val if isinstance(val, unicode) else val.decode('utf-8')
+
+
+class Entry(object):
+    """A compact LDAP entry, read like the attrs dict of python-ldap"""
+
+    __slots__ = ('dn', 'layout', '_values')
+
+    def __init__(self, dn, layout, values):
+        self.dn = dn
+        self.layout = layout
+        self._values = values
+
+    @classmethod
+    def from_ldap(cls, dn, attrs, names=None):
+        """an Entry of a (dn, attrs) search result
+
+        Args:
+            names: attribute names to keep, default all attrs of the entry
+        """
+        if names is None:
+            names = sorted(attrs)
+        l = layout(names)
+
+        if len(attrs) == len(l) and all(n in attrs for n in l.names):
+            values = tuple(_pack(attrs[n]) for n in l.names)
+        else:
+            # attribute names of the server may differ in case.
+            lowered = dict((n.lower(), v) for n, v in attrs.iteritems())
+            values = tuple(_pack(lowered.get(n.lower())) for n in l.names)
+
+        return cls(dn, l, values)
+
+    def _raw(self, name):
+        idx = self.layout.index(name)
+        return self._values[idx] if idx is not None else None
+
+    def get(self, name, default=None):
+        """the first value of an attribute"""
+        val = self._raw(name)
+        if val is None:
+            return default
+
+        return val[0] if isinstance(val, tuple) else val
+
+    def values(self, name):
+        """all values of an attribute, an empty list if it has none"""
+        val = self._raw(name)
+        if val is None:
+            return []
+
+        return list(val) if isinstance(val, tuple) else [val]
+
+    def text(self, name, default=None):
+        """the first value of an attribute decoded to unicode"""
+        val = self.get(name)
+        return _decode(val) if val is not None else default
+
+    def __getitem__(self, name):
+        """all values of an attribute, like attrs[name] of python-ldap"""
+        if self._raw(name) is None:
+            raise KeyError(name)
+
+        return self.values(name)
+
+    def __contains__(self, name):
+        return self._raw(name) is not None
+
+    def keys(self):
+        return [n for n, v in zip(self.layout.names, self._values) if v is not None]
+
+    def to_ldap(self):
+        """the (dn, attrs) tuple of python-ldap"""
+        return self.dn, dict((n, self.values(n)) for n in self.keys())
+
+    def __str__(self):
+        return self.dn
+
+    __repr__ = __str__
+
+
+def compact(results, cls=Entry, names=None):
+    """Entries of (dn, attrs) search results, e.g. of Client.search or Client.search_paged"""
+    for dn, attrs in results or []:
+        # skip search continuation references
+        if dn is not None:
+            yield cls.from_ldap(dn, attrs, names)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+identity -- synthetic identity generator
+
+Identities are generated in batches of columns, vectorized with NumPy if
+it's installed, and are reproducible with a seed.
+
+@author:     FengXi
+"""
+
+import bisect
+import logging
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("identity")
+
+# lengths of sampled phone numbers
+TEL_LENGTHS = (8, 9, 10, 11, 12)
+
+
+def weight(fields):
+    """weight of a name of the split fields of a dictionary line, its frequency column
+
+    Lines may have a frequency column after the name, as in the census
+    "name frequency cumulative-frequency rank" files.
+    """
+    try:
+        return float(fields[1])
+    except (IndexError, ValueError):
+        raise ValueError("no frequency column in line: %s" % ' '.join(fields))
+
+
+class Column(object):
+    """choices of a column, picked uniformly or by weights"""
+
+    def __init__(self, choices, weights=None):
+        self.choices = choices
+
+        self._cumulative = None
+        self._p = None
+        if weights:
+            total = 0.0
+            self._cumulative = []
+            for w in weights:
+                total += w
+                self._cumulative.append(total)
+
+            if numpy is not None:
+                self._p = numpy.asarray(weights, dtype=float) / total
+
+    def pick(self, size, rng, nprng=None):
+        """pick `size` choices"""
+        n = len(self.choices)
+
+        if nprng is not None:
+            if self._p is not None:
+                idx = nprng.choice(n, size, p=self._p)
+            else:
+                idx = nprng.randint(0, n, size)
+            return [self.choices[i] for i in idx.tolist()]
+
+        if self._cumulative:
+            total = self._cumulative[-1]
+            return [self.choices[min(bisect.bisect_left(self._cumulative, rng.random() * total), n - 1)]
+                    for _ in xrange(0, size)]
+
+        return [self.choices[int(rng.random() * n)] for _ in xrange(0, size)]
+
+
+class Generator(object):
+    """Generates batches of identities
+
+    The same seed generates the same identities, as long as NumPy is
+    installed, or not, on both runs.
+    """
+
+    def __init__(self, firstname_choices, lastname_choices, username_choices, firstname_weights=None,
+                 lastname_weights=None, seed=None, use_numpy=True):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.nprng = numpy.random.RandomState(seed) if numpy is not None and use_numpy else None
+
+        self.firstnames = Column(firstname_choices, firstname_weights)
+        self.lastnames = Column(lastname_choices, lastname_weights)
+        self.usernames = Column(username_choices)
+
+    def __str__(self):
+        return "seed=%s,numpy=%s" % (self.seed, self.nprng is not None)
+
+    __repr__ = __str__
+
+    def tels(self, size):
+        """`size` phone numbers of random lengths"""
+        if self.nprng is not None:
+            lengths = self.nprng.choice(TEL_LENGTHS, size)
+            numbers = self.nprng.randint(0, 10 ** max(TEL_LENGTHS), size, dtype=numpy.int64) % (10 ** lengths)
+            return ['%0*d' % (l, v) for l, v in zip(lengths.tolist(), numbers.tolist())]
+
+        tels = []
+        for _ in xrange(0, size):
+            l = TEL_LENGTHS[int(self.rng.random() * len(TEL_LENGTHS))]
+            tels.append('%0*d' % (l, self.rng.randrange(10 ** l)))
+
+        return tels
+
+    def batch(self, size, prefix=None, start=0):
+        """generate a batch of identities as columns
+
+        With a prefix, usernames are prefix.start .. prefix.(start + size - 1)
+        and names are derived from them, otherwise they are picked randomly.
+
+        Returns:
+            a dict of columns: username, first_name, last_name, email, mobile, tel
+        """
+        if prefix:
+            idx = xrange(start, start + size)
+            usernames = ["%s.%s" % (prefix, i) for i in idx]
+            first_names = ["%s_fn.%s" % (prefix, i) for i in idx]
+            last_names = ["%s_ln.%s" % (prefix, i) for i in idx]
+        else:
+            usernames = self.usernames.pick(size, self.rng, self.nprng)
+            first_names = self.firstnames.pick(size, self.rng, self.nprng)
+            last_names = self.lastnames.pick(size, self.rng, self.nprng)
+
+        return {
+            'username': usernames,
+            'first_name': first_names,
+            'last_name': last_names,
+            'email': ["%s@mailinator.com" % u for u in usernames],
+            'mobile': self.tels(size),
+            'tel': self.tels(size),
+        }
+
+    def suffix(self, username):
+        """a variant of a username already taken"""
+        return "%s_%s" % (username, self.rng.randint(0, 10 ** 9))
+
+
+if __name__ == "__main__":
+    pass
@@ -6,11 +6,18 @@ ldap_client -- LDAP client with very basic LDAP operations.
 @author:     FengXi
 """
 
+import collections
+import contextlib
 import logging
 import ldap 
+import ldap.dn
 import ldap.modlist as modlist
+from ldap.controls import LDAPControl
+from ldap.controls import SimplePagedResultsControl
 import basedn
 import sys
+import threading
+import time
 
 logger = logging.getLogger('ldap_client')
 
@@ -57,18 +64,208 @@ class Server(object):
             return "ldap://%s:%s" % (self.ip, self.port)
 
 
+# not found in the cache
+_MISSING = object()
+
 # default server
 DEFAULT_SERVER = Server("localhost", 1389, "ldap://localhost:1389")
 
 # default binding user and password, openldap
 DEFAULT_ACCOUNT = Account("cn=admin,dc=example,dc=com", "admin")
 
+# default python-ldap trace level, 2 dumps every request and response, 0 for none
+DEFAULT_TRACE_LEVEL = 2
+
+# default # of outstanding asynchronous requests in a pipeline
+DEFAULT_WINDOW = 64
+
+# default # of entries per page of a paged search
+DEFAULT_PAGE_SIZE = 1000
+
+# default # of values of an OR-filter of a batch lookup
+DEFAULT_BATCH = 100
+
+# Tree Delete control, see draft-armijo-ldap-treedelete
+SUBTREE_DELETE_CONTROL = '1.2.840.113556.1.4.805'
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of bound LDAP connections.
+
+    Connections idle longer than `probe_interval` are probed with a WhoAmI
+    before being borrowed, dead ones are reconnected and rebound. A connection
+    raising SERVER_DOWN is discarded. Idle connections beyond `min_size` are
+    closed after `idle_timeout` seconds.
+    """
+
+    def __init__(self, server=DEFAULT_SERVER, account=DEFAULT_ACCOUNT, min_size=1, max_size=10, idle_timeout=300,
+                 probe_interval=30, trace_level=DEFAULT_TRACE_LEVEL, trace_file=sys.stdout):
+        self.server = server
+        self.account = account
+        self.min_size = min_size
+        self.max_size = max(1, max_size, min_size)
+        self.idle_timeout = idle_timeout
+        self.probe_interval = probe_interval
+        self.trace_level = trace_level
+        self.trace_file = trace_file
+
+        self._cond = threading.Condition()
+        # (connection, last used time), most recently used on the right
+        self._idle = collections.deque()
+        # # of connections opened and not discarded, idle or borrowed
+        self._size = 0
+        self._closed = False
+
+        for _ in range(0, min_size):
+            self._size += 1
+            self._idle.append((self._open(), time.time()))
+
+    def __str__(self):
+        return "%s,size=%s,idle=%s" % (self.server, self._size, len(self._idle))
+
+    __repr__ = __str__
+
+    def _open(self):
+        """open a bound connection"""
+        logger.debug("connect to %s", self.server)
+        # blind trust all certs for test purpose.
+        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+
+        conn = ldap.initialize(uri=self.server.uri, trace_level=self.trace_level, trace_file=self.trace_file)
+        conn.simple_bind_s(who=self.account.dn, cred=self.account.password)
+        return conn
+
+    def _unbind(self, conn):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError as e:
+            logger.debug("error during unbind: %s", e)
+
+    def _alive(self, conn):
+        """liveness probe"""
+        try:
+            conn.whoami_s()
+            return True
+        except ldap.LDAPError as e:
+            logger.info("connection to %s is dead: %s", self.server, e)
+            return False
+
+    def _expire(self, now):
+        """pop the connections idle too long, beyond min_size. must hold the lock."""
+        expired = []
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+
+        return expired
+
+    def acquire(self, timeout=None):
+        """borrow a bound connection, wait up to timeout seconds(None for ever) if all are borrowed"""
+        deadline = time.time() + timeout if timeout is not None else None
+        conn = None
+        used = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ldap.LDAPError("connection pool is closed.")
+
+                expired = self._expire(time.time())
+                if self._idle:
+                    conn, used = self._idle.pop()
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise ldap.TIMEOUT("no connection available in %s seconds." % timeout)
+                self._cond.wait(remaining)
+
+        for c in expired:
+            self._unbind(c)
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif time.time() - used > self.probe_interval and not self._alive(conn):
+                self._unbind(conn)
+                conn = self._open()
+        except Exception:
+            self._discarded()
+            raise
+
+        return conn
+
+    def release(self, conn, discard=False):
+        """return a borrowed connection, discard it if it's broken"""
+        if discard or self._closed:
+            self._unbind(conn)
+            self._discarded()
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def _discarded(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """borrow a connection in a with statement"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except ldap.SERVER_DOWN:
+            self.release(conn, discard=True)
+            raise
+        except:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """unbind all idle connections, borrowed ones are unbound when released"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._unbind(conn)
+
 
 class Client(object):
-    """LDAP client"""
+    """LDAP client
+
+    With a ConnectionPool, operations borrow bound connections from the pool,
+    so one client can be shared by many threads. Otherwise they run on the
+    connection of connect/connect_bind.
+
+    With a stats.Metrics, count and latency of every operation are recorded.
+
+    trace_level is the python-ldap trace level of connect/connect_bind, unless
+    they are called with one.
 
-    def __init__(self, server=DEFAULT_SERVER):
+    With a cache.TTLCache, entryUUID and existence lookups are cached, an
+    entry is invalidated when it's added, deleted or modified by this client.
+    """
+
+    def __init__(self, server=DEFAULT_SERVER, pool=None, metrics=None, trace_level=DEFAULT_TRACE_LEVEL,
+                 cache=None):
         self.server = server
+        self.pool = pool
+        self.metrics = metrics
+        self.trace_level = trace_level
+        self.cache = cache
         self._conn = None
 
     def __str__(self):
@@ -76,11 +273,14 @@ class Client(object):
 
     __repr__ = __str__
 
-    def connect(self, trace_level=2, trace_file=sys.stdout):
+    def connect(self, trace_level=None, trace_file=sys.stdout):
         """Connect to a LDAP server.
 
         """
-        logger.info("connect to %s" % self.server)
+        if trace_level is None:
+            trace_level = self.trace_level
+
+        logger.debug("connect to %s", self.server)
         # blind trust all certs for test purpose.
         ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
 
@@ -91,9 +291,10 @@ class Client(object):
     def bind(self, account=DEFAULT_ACCOUNT):
         """bind the LDAP connection to a user"""
         if self._conn:
-            self._conn.simple_bind_s(who=account.dn, cred=account.password)
+            with self._instrument('bind', account.dn):
+                self._conn.simple_bind_s(who=account.dn, cred=account.password)
 
-    def connect_bind(self, account=DEFAULT_ACCOUNT, trace_level=2, trace_file=sys.stdout):
+    def connect_bind(self, account=DEFAULT_ACCOUNT, trace_level=None, trace_file=sys.stdout):
         """Connect to a LDAP server and auto bind in sync.
 
         server: the server instance of LDAP server.
@@ -110,9 +311,41 @@ class Client(object):
     def close(self):
         """close and unbind a LDAP connection"""
         if self._conn:
-            logger.info("close connection.")
+            logger.debug("close connection.")
             self._conn.unbind_s()
 
+    @contextlib.contextmanager
+    def _connection(self):
+        """the connection to run an operation on"""
+        if self.pool is None:
+            yield self._conn
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+
+    @contextlib.contextmanager
+    def _instrument(self, op, dn=None):
+        """record an operation to the metrics"""
+        if self.metrics is None:
+            yield
+            return
+
+        start = self.metrics.start(op, dn)
+        try:
+            yield
+        except ldap.LDAPError as e:
+            self.metrics.finish(op, dn, start, type(e).__name__)
+            raise
+        else:
+            self.metrics.finish(op, dn, start)
+
+    @contextlib.contextmanager
+    def _operation(self, op, dn=None):
+        """the connection to run an operation on, the operation is recorded to the metrics"""
+        with self._connection() as conn:
+            with self._instrument(op, dn):
+                yield conn
+
     def add_entry(self, dn, attrs):
         """add an ldap entry
 
@@ -134,8 +367,12 @@ class Client(object):
         if attrs and dn:
             ldif = modlist.addModlist(attrs)
             # Do the actual synchronous add-operation to the ldapserver
-            logger.info("add entry %s." % ldif)
-            self._conn.add_s(dn, ldif)
+            logger.debug("add entry %s: %s", dn, ldif)
+            try:
+                with self._operation('add', dn) as conn:
+                    conn.add_s(dn, ldif)
+            finally:
+                self._invalidate(dn)
 
     def add_entry_ext(self, dn, attrs, serverctrls=None, clientctrls=None):
         """add an ldap entry
@@ -158,9 +395,143 @@ class Client(object):
         if attrs and dn:
             ldif = modlist.addModlist(attrs)
             # Do the actual synchronous add-operation to the ldapserver
-            logger.info("add entry %s." % ldif)
+            logger.debug("add entry %s: %s", dn, ldif)
             ldap.CONTROL_POST_READ
-            return self._conn.add_ext_s(dn, ldif, serverctrls=serverctrls, clientctrls=clientctrls)
+            try:
+                with self._operation('add', dn) as conn:
+                    return conn.add_ext_s(dn, ldif, serverctrls=serverctrls, clientctrls=clientctrls)
+            finally:
+                self._invalidate(dn)
+
+    def add_entries(self, entries, window=DEFAULT_WINDOW):
+        """add many ldap entries in a pipeline
+
+        Up to `window` add requests are sent asynchronously before waiting for
+        the oldest one, so the bulk add runs at the server's write speed instead
+        of one round trip per entry.
+
+        Args:
+            entries: an iterable of (dn, attrs) tuples, see add_entry. a None
+                     entry waits for all outstanding adds, e.g. before adding
+                     the children of entries still in flight
+            window: max # of outstanding add requests
+
+        Returns:
+            a list of (dn, error) tuples for the entries failed to add
+        """
+        def _add(conn, dn, attrs):
+            logger.debug("add entry %s.", dn)
+            return conn.add_ext(dn, modlist.addModlist(attrs))
+
+        return self._pipeline(_add, entries, window, op='add', invalidate=True)
+
+    def modify_entries(self, modifications, window=DEFAULT_WINDOW):
+        """modify many ldap entries in a pipeline of `window` outstanding modify requests
+
+        Args:
+            modifications: an iterable of (dn, modlist) tuples
+
+        Returns:
+            a list of (dn, error) tuples for the modifications failed
+        """
+        def _modify(conn, dn, mods):
+            logger.debug("modify entry %s.", dn)
+            return conn.modify_ext(dn, mods)
+
+        return self._pipeline(_modify, modifications, window, op='modify', invalidate=True)
+
+    def search_many(self, base, filterstrs, scope=ldap.SCOPE_ONELEVEL, attrlist=None, window=DEFAULT_WINDOW):
+        """search under a base with many filters, the searches are sent in a pipeline
+
+        Returns:
+            (list of (dn, attrs) entries of all searches, list of (base, error) for the searches failed)
+        """
+        entries = []
+
+        def _search(conn, base, filterstr):
+            return conn.search_ext(base, scope, filterstr, attrlist)
+
+        def _collect(rdata):
+            # skip search continuation references
+            entries.extend((dn, attrs) for dn, attrs in rdata if dn is not None)
+
+        failures = self._pipeline(_search, ((base, f) for f in filterstrs), window, op='search',
+                                  on_result=_collect)
+        return entries, failures
+
+    def _pipeline(self, submit, requests, window, op=None, on_result=None, invalidate=False, conn=None):
+        """send asynchronous requests with a bounded window of outstanding msgids
+
+        Args:
+            submit: a callable which sends one request and returns its msgid,
+                    it's called with the connection and the items of a request tuple
+            requests: an iterable of tuples whose first item is the target dn,
+                      or None to wait for all outstanding requests
+            window: max # of outstanding requests
+            op: the operation type recorded to the metrics
+            on_result: a callable called with the result data of every request succeeded
+            invalidate: whether the requests are writes, their dns are dropped from
+                        the lookup cache once their results arrive
+            conn: the connection to send the requests on, one is taken from the pool if not given
+
+        Returns:
+            a list of (dn, error) tuples for the failed requests
+        """
+        if conn is None:
+            with self._connection() as conn:
+                return self._pipeline(submit, requests, window, op, on_result, invalidate, conn)
+
+        window = max(1, window)
+        pending = collections.deque()
+        failures = []
+
+        for request in requests:
+            if request is None:
+                while pending:
+                    self._wait_oldest(conn, pending, failures, op, on_result, invalidate)
+                continue
+
+            if len(pending) >= window:
+                self._wait_oldest(conn, pending, failures, op, on_result, invalidate)
+
+            dn = request[0]
+            start = self.metrics.start(op, dn) if self.metrics else None
+            try:
+                msgid = submit(conn, *request)
+            except ldap.SERVER_DOWN:
+                raise
+            except ldap.LDAPError as e:
+                if self.metrics:
+                    self.metrics.finish(op, dn, start, type(e).__name__)
+                failures.append((dn, e))
+                continue
+
+            pending.append((msgid, dn, start))
+
+        while pending:
+            self._wait_oldest(conn, pending, failures, op, on_result, invalidate)
+
+        return failures
+
+    def _wait_oldest(self, conn, pending, failures, op=None, on_result=None, invalidate=False):
+        """wait for the result of the oldest outstanding request"""
+        msgid, dn, start = pending.popleft()
+        try:
+            _, rdata, _, _ = conn.result3(msgid, all=1)
+            if self.metrics:
+                self.metrics.finish(op, dn, start)
+            if on_result:
+                on_result(rdata)
+        except ldap.LDAPError as e:
+            if self.metrics:
+                self.metrics.finish(op, dn, start, type(e).__name__)
+            if isinstance(e, ldap.SERVER_DOWN):
+                raise
+            logger.debug("request on %s failed: %s", dn, e)
+            failures.append((dn, e))
+        finally:
+            if invalidate:
+                self._invalidate(dn)
 
     def delete_entry(self, dn):
         """delete an ldap entry by its dn
@@ -170,24 +541,151 @@ class Client(object):
 
         """
         if dn:
-            logger.info("delete entry: %s", dn)
-            self._conn.delete_s(dn)
+            logger.debug("delete entry: %s", dn)
+            try:
+                with self._operation('delete', dn) as conn:
+                    conn.delete_s(dn)
+            finally:
+                self._invalidate(dn)
+
+    def delete_entries(self, dns, window=DEFAULT_WINDOW):
+        """delete many ldap entries in a pipeline of `window` outstanding delete requests
+
+        Returns:
+            a list of (dn, error) tuples for the entries failed to delete
+        """
+        return self._pipeline(self._delete_ext, ((dn,) for dn in dns), window, op='delete', invalidate=True)
+
+    def delete_search(self, base, scope=ldap.SCOPE_ONELEVEL, filterstr='(objectClass=*)', window=DEFAULT_WINDOW,
+                      page_size=DEFAULT_PAGE_SIZE, on_deleted=None):
+        """delete the entries found by a paged search in a pipeline of `window` outstanding delete requests
+
+        The search runs on the connection of the delete pipeline, so the entries
+        are deleted page by page as they arrive, with a single pooled connection.
+
+        Args:
+            on_deleted: a callable called once an entry is deleted
+
+        Returns:
+            a list of (dn, error) tuples for the entries failed to delete
+        """
+        with self._connection() as conn:
+            dns = ((dn,) for dn, _ in self._search_paged(conn, base, scope, filterstr, ["1.1"], page_size))
+            on_result = (lambda rdata: on_deleted()) if on_deleted else None
+            return self._pipeline(self._delete_ext, dns, window, op='delete', on_result=on_result, invalidate=True,
+                                  conn=conn)
+
+    def _delete_ext(self, conn, dn):
+        logger.debug("delete entry: %s", dn)
+        return conn.delete_ext(dn)
+
+    def delete_tree(self, base_dn, window=DEFAULT_WINDOW, subtree_control=False,
+                    page_size=DEFAULT_PAGE_SIZE):
+        """delete an entry and its whole subtree
+
+        The subtree is enumerated once with a paged search, then deleted level
+        by level from the deepest one, all entries of a level are deleted in a
+        pipeline.
+
+        Args:
+            window: max # of outstanding delete requests
+            subtree_control: send a single delete with the Tree Delete control
+                             instead, if the server supports it
+
+        Returns:
+            a list of (dn, error) tuples for the entries failed to delete
+        """
+        if subtree_control and self.supports_control(SUBTREE_DELETE_CONTROL):
+            logger.info("delete tree %s with the tree delete control.", base_dn)
+            try:
+                with self._operation('delete', base_dn) as conn:
+                    conn.delete_ext_s(base_dn, serverctrls=[LDAPControl(SUBTREE_DELETE_CONTROL, True)])
+            finally:
+                if self.cache is not None:
+                    self.cache.clear()
+            return []
+
+        levels = collections.defaultdict(list)
+        for dn, _ in self.search_paged(base_dn, scope=ldap.SCOPE_SUBTREE, attrlist=["1.1"], page_size=page_size):
+            levels[len(ldap.dn.str2dn(dn))].append(dn)
+
+        failures = []
+        for depth in sorted(levels, reverse=True):
+            logger.info("delete %s entries at depth %s under %s.", len(levels[depth]), depth, base_dn)
+            failures.extend(self.delete_entries(levels[depth], window=window))
+
+        return failures
+
+    def recursive_delete(self, base_dn, window=DEFAULT_WINDOW):
+        """delete an entry and its subtree, see delete_tree
+
+        Raises the error of the first entry failed to delete.
+        """
+        failures = self.delete_tree(base_dn, window=window)
+        if failures:
+            raise failures[0][1]
 
-    def recursive_delete(self, base_dn):
-        search = self._conn.search_s(base_dn, ldap.SCOPE_ONELEVEL)
+    def root_dse(self, attrlist=None):
+        """read the root DSE"""
+        r = self.search('', scope=ldap.SCOPE_BASE, attrlist=attrlist or ["*", "+"])
+        if r:
+            return r[0][1]
 
-        for dn, _ in search:
-            self.recursive_delete(dn)
+        return {}
 
-        self.delete_entry(base_dn)
+    def supports_control(self, oid):
+        """check if the server supports a control"""
+        return oid in self.root_dse(["supportedControl"]).get("supportedControl", [])
 
     def search(self, base, scope=ldap.SCOPE_ONELEVEL, filterstr='(objectClass=*)', attrlist=None):
         try:
-            return self._conn.search_s(base, scope, filterstr, attrlist)
+            with self._operation('search', base) as conn:
+                return conn.search_s(base, scope, filterstr, attrlist)
+        except ldap.SIZELIMIT_EXCEEDED:
+            logger.error("sizelimit exceeded during search under %s, use search_paged instead.", base)
+            return None
         except Exception:
             logger.debug("error during search.")
             return None
 
+    def search_paged(self, base, scope=ldap.SCOPE_ONELEVEL, filterstr='(objectClass=*)', attrlist=None,
+                     page_size=DEFAULT_PAGE_SIZE):
+        """search with the Simple Paged Results control
+
+        Entries are yielded page by page as they arrive, so the whole result
+        set is never held in memory and the server sizelimit is not hit.
+
+        Yields:
+            (dn, attrs) tuples
+        """
+        with self._connection() as conn:
+            for entry in self._search_paged(conn, base, scope, filterstr, attrlist, page_size):
+                yield entry
+
+    def _search_paged(self, conn, base, scope, filterstr, attrlist, page_size):
+        """search_paged on a connection"""
+        ctrl = SimplePagedResultsControl(True, size=page_size, cookie='')
+
+        while True:
+            with self._instrument('search', base):
+                msgid = conn.search_ext(base, scope, filterstr, attrlist, serverctrls=[ctrl])
+                _, rdata, _, serverctrls = conn.result3(msgid)
+
+            for dn, attrs in rdata:
+                # skip search continuation references
+                if dn is not None:
+                    yield dn, attrs
+
+            cookie = None
+            for c in serverctrls:
+                if c.controlType == SimplePagedResultsControl.controlType:
+                    cookie = c.cookie
+
+            if not cookie:
+                break
+
+            ctrl.cookie = cookie
+
     def search_user_entryuuid(self, tenant_name, username):
         """search an user's entryuuid"""
         dn = basedn.people_dn(username, tenant_name)
@@ -195,6 +693,12 @@ class Client(object):
 
     def search_entry_uuid(self, dn):
         """search an entry's entryuuid"""
+        if self.cache is not None:
+            uuid = self.cache.get(('uuid', self._cache_key(dn)), _MISSING)
+            if uuid is _MISSING:
+                _, uuid = self._lookup(dn)
+            return uuid
+
         r = self.search(base=dn, scope=ldap.SCOPE_BASE, attrlist=["entryUUID"])
         if r is not None and len(r) == 1:
             _, uuids = r[0]
@@ -202,8 +706,105 @@ class Client(object):
 
         return None
 
+    def _cache_key(self, dn):
+        return dn.lower()
+
+    def _invalidate(self, dn):
+        if self.cache is not None:
+            key = self._cache_key(dn)
+            self.cache.invalidate(('uuid', key))
+            self.cache.invalidate(('exists', key))
+
+    def _lookup(self, dn):
+        """read the existence and entryUUID of an entry into the cache
+
+        Returns:
+            (exists, entryUUID), errors other than NO_SUCH_OBJECT are not cached
+        """
+        try:
+            with self._operation('search', dn) as conn:
+                r = conn.search_s(dn, ldap.SCOPE_BASE, '(objectClass=*)', ["entryUUID"])
+        except ldap.NO_SUCH_OBJECT:
+            r = []
+        except ldap.LDAPError as e:
+            logger.debug("error during search: %s", e)
+            return False, None
+
+        exists = len(r) > 0
+        uuid = r[0][1].get('entryUUID', [None])[0] if exists else None
+
+        key = self._cache_key(dn)
+        self.cache.put(('exists', key), exists)
+        self.cache.put(('uuid', key), uuid)
+        return exists, uuid
+
+    def resolve_entry_uuids(self, dns, batch=DEFAULT_BATCH):
+        """resolve the entryUUIDs of many entries
+
+        Cached entries cost no network traffic. The others are grouped by
+        parent and looked up by their RDN values, up to `batch` values in a
+        single OR-filter search. Entries must have a single valued RDN.
+
+        Returns:
+            a dict of dn -> entryUUID, None if the entry does not exist
+        """
+        uuids = {}
+        # parent dn -> rdn attr -> lowercased rdn value -> dns
+        misses = collections.defaultdict(lambda: collections.defaultdict(dict))
+
+        for dn in dns:
+            uuid = _MISSING
+            if self.cache is not None:
+                uuid = self.cache.get(('uuid', self._cache_key(dn)), _MISSING)
+
+            if uuid is _MISSING:
+                rdns = ldap.dn.str2dn(dn)
+                attr, val, _ = rdns[0][0]
+                misses[ldap.dn.dn2str(rdns[1:])][attr.lower()].setdefault(val.lower(), []).append(dn)
+            else:
+                uuids[dn] = uuid
+
+        for parent, by_attr in misses.iteritems():
+            for attr, by_val in by_attr.iteritems():
+                vals = by_val.keys()
+                for idx in xrange(0, len(vals), batch):
+                    chunk = vals[idx:idx + batch]
+                    found = {}
+                    r = self.search(parent, filterstr=basedn.or_filter(attr, chunk), attrlist=["entryUUID", attr])
+                    for _, entry in r or []:
+                        for name, values in entry.iteritems():
+                            if name.lower() == attr:
+                                for v in values:
+                                    found[v.lower()] = entry.get('entryUUID', [None])[0]
+
+                    for val in chunk:
+                        for dn in by_val[val]:
+                            uuids[dn] = found.get(val)
+                            # a failed search is not cached as missing entries.
+                            if self.cache is not None and r is not None:
+                                self.cache.put(('uuid', self._cache_key(dn)), uuids[dn])
+
+        return uuids
+
+    def resolve_user_entryuuids(self, tenant_name, usernames, batch=DEFAULT_BATCH):
+        """resolve the entryUUIDs of many users, see resolve_entry_uuids
+
+        Returns:
+            a dict of username -> entryUUID, None if the user does not exist
+        """
+        usernames = list(usernames)
+        dns = dict(zip(basedn.people_dns(usernames, tenant_name), usernames))
+        return dict((dns[dn], uuid) for dn, uuid in self.resolve_entry_uuids(dns.keys(), batch).iteritems())
+
     def exists_entry(self, dn, filterstr='(objectclass=*)'):
         """check if an entry exists"""
+        cacheable = self.cache is not None and filterstr == '(objectclass=*)'
+        if cacheable:
+            exists = self.cache.get(('exists', self._cache_key(dn)), _MISSING)
+            if exists is _MISSING:
+                exists, _ = self._lookup(dn)
+            return exists
+
         try:
             r = self.search(dn, scope=ldap.SCOPE_BASE, filterstr=filterstr,
                             attrlist=["1.1"])
@@ -223,7 +824,11 @@ class Client(object):
         mod = (ldap.MOD_ADD, attr_name, attr_val)
         modlist = (mod,)
 
-        self._conn.modify_s(dn, modlist)
+        try:
+            with self._operation('modify', dn) as conn:
+                conn.modify_s(dn, modlist)
+        finally:
+            self._invalidate(dn)
 
     def replace_entry(self, dn, attrs):
         """replace an existing entry"""
@@ -231,15 +836,22 @@ class Client(object):
         for name, val in attrs.iteritems():
             mod = (ldap.MOD_REPLACE, name, val)
             mods.append(mod)
-        if modlist:
-            self._conn.modify_s(dn, mods)
-        pass
+        if mods:
+            try:
+                with self._operation('modify', dn) as conn:
+                    conn.modify_s(dn, mods)
+            finally:
+                self._invalidate(dn)
 
     def replace_one_attr(self, dn, attr_name, attr_val):
         mod = (ldap.MOD_REPLACE, attr_name, attr_val)
         mods = (mod,)
 
-        self._conn.modify_s(dn, mods)
+        try:
+            with self._operation('modify', dn) as conn:
+                conn.modify_s(dn, mods)
+        finally:
+            self._invalidate(dn)
 
     def create_ou(self, dn, name, description):
         """Create an LDAP ou
@@ -251,7 +863,11 @@ class Client(object):
         mod = (ldap.MOD_DELETE, attr_name, attr_val)
         modlist = (mod,)
 
-        self._conn.modify_s(dn, modlist)
+        try:
+            with self._operation('modify', dn) as conn:
+                conn.modify_s(dn, modlist)
+        finally:
+            self._invalidate(dn)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ldifdata -- LDIF export/import of sampled data
+
+@author:     FengXi
+"""
+
+import logging
+import Queue
+import threading
+
+import ldap.dn
+import ldif
+import ldap_client
+
+logger = logging.getLogger("ldifdata")
+
+# end of an LDIF stream, see read
+_END = object()
+
+
+def write(out, entries):
+    """write entries to an LDIF stream
+
+    Args:
+        out: a file-like object
+        entries: an iterable of (dn, attrs) tuples, as built by subject.CRUD.entry or organization.CRUD.entry
+
+    Returns:
+        # of entries written
+    """
+    writer = ldif.LDIFWriter(out)
+
+    count = 0
+    for dn, attrs in entries:
+        entry = {}
+        for name, val in attrs.iteritems():
+            entry[name] = val if isinstance(val, (list, tuple)) else [val]
+
+        writer.unparse(dn, entry)
+        count += 1
+
+    return count
+
+
+class _Parser(ldif.LDIFParser):
+    """LDIF parser putting entries to a queue"""
+
+    def __init__(self, inp, queue):
+        ldif.LDIFParser.__init__(self, inp)
+        self._queue = queue
+
+    def handle(self, dn, entry):
+        self._queue.put((dn, entry))
+
+
+def read(inp, buffer_size=10000):
+    """read entries from an LDIF stream
+
+    The stream is parsed in a background thread, up to buffer_size entries
+    ahead of the consumer, so the whole stream is never held in memory.
+
+    Returns:
+        a generator of (dn, attrs) tuples
+    """
+    queue = Queue.Queue(buffer_size)
+    errors = []
+
+    def _parse():
+        try:
+            _Parser(inp, queue).parse()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            queue.put(_END)
+
+    t = threading.Thread(target=_parse)
+    t.daemon = True
+    t.start()
+
+    while True:
+        entry = queue.get()
+        if entry is _END:
+            break
+        yield entry
+
+    t.join()
+    if errors:
+        raise errors[0]
+
+
+def _with_barriers(entries):
+    """wait for outstanding adds before an entry whose parent may be still in flight,
+    so a child is never added before its parent completes.
+
+    Entries sent since the last wait are taken as in flight.
+    """
+    inflight = set()
+    for dn, attrs in entries:
+        rdns = ldap.dn.str2dn(dn)
+        if ldap.dn.dn2str(rdns[1:]).lower() in inflight:
+            yield None
+            inflight.clear()
+
+        inflight.add(ldap.dn.dn2str(rdns).lower())
+        yield dn, attrs
+
+
+def load(client, inp, window=ldap_client.DEFAULT_WINDOW):
+    """add all entries of an LDIF stream in a pipeline, see ldap_client.Client.add_entries
+
+    Entries must be ordered parents before children.
+
+    Returns:
+        a list of (dn, error) tuples for the entries failed to add
+    """
+    return client.add_entries(_with_barriers(read(inp)), window=window)
+
+
+if __name__ == "__main__":
+    pass
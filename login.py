@@ -6,15 +6,328 @@ login -- login utility
 @author:     FengXi
 """
 
+import bisect
 import logging
+import multiprocessing
+import Queue
+import random
 import sys
+import threading
+import time
 
+import async_client
+import basedn
+import ldap
 import ldap_client
+import stats
 from argparse import ArgumentParser
 from argparse import ArgumentDefaultsHelpFormatter
 
 logger = logging.getLogger("login")
 
+# connect, bind and close on every login
+RECONNECT = "reconnect"
+# connect once, then bind the same connection on every login
+REBIND = "rebind"
+
+
+# pick users of a credential pool with equal probability
+UNIFORM = "uniform"
+# pick the k-th user of a credential pool with probability proportional to 1/k^s
+ZIPF = "zipf"
+
+
+class CredentialPool(object):
+    """A pool of user accounts sharing one password, picked uniformly or by a Zipf distribution."""
+
+    def __init__(self, dns, password="1", access=UNIFORM, zipf_s=1.0):
+        self.dns = dns
+        self.password = password
+        self.access = access
+
+        self._cumulative = None
+        if access == ZIPF:
+            total = 0.0
+            self._cumulative = []
+            for k in xrange(1, len(dns) + 1):
+                total += 1.0 / (k ** zipf_s)
+                self._cumulative.append(total)
+
+    def pick(self, rng=random):
+        """pick an Account"""
+        if self._cumulative:
+            idx = bisect.bisect_left(self._cumulative, rng.random() * self._cumulative[-1])
+            dn = self.dns[min(idx, len(self.dns) - 1)]
+        else:
+            dn = rng.choice(self.dns)
+
+        return ldap_client.Account(dn, self.password)
+
+    def __len__(self):
+        return len(self.dns)
+
+    def __str__(self):
+        return "users=%s,access=%s" % (len(self.dns), self.access)
+
+    __repr__ = __str__
+
+
+class BindResult(object):
+    """bind results of a worker"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = stats.Histogram()
+        self.error_latency = stats.Histogram()
+        # client operations
+        self.metrics = stats.Metrics()
+
+    def record(self, seconds, ok):
+        self.count += 1
+        if ok:
+            self.latency.record(seconds)
+        else:
+            self.errors += 1
+            self.error_latency.record(seconds)
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+        self.error_latency.merge(other.error_latency)
+        self.metrics.merge(other.metrics)
+
+
+def _close(client):
+    try:
+        client.close()
+    except ldap.LDAPError as e:
+        logger.debug("error during close: %s", e)
+
+
+def _bind_worker(server, account, count, mode, interval, deadline, stop, results, trace_level, trace_sample):
+    """bind `count` times(0 for infinite) until the deadline or stopped, then put a BindResult to results.
+
+    account: an Account, or a CredentialPool to pick an account from on every bind.
+    interval: seconds between the intended starts of two binds, None for a closed loop.
+    trace_sample: trace 1 in every # binds.
+    """
+    result = BindResult()
+    pool = account if isinstance(account, CredentialPool) else None
+    # workers must not share the random state, forked processes would pick the same users.
+    rng = random.Random()
+    if trace_sample:
+        result.metrics.add_hook(post=stats.SampledTrace(trace_sample))
+    client = ldap_client.Client(server, metrics=result.metrics, trace_level=trace_level)
+
+    try:
+        if mode == REBIND:
+            client.connect()
+
+        next_start = time.time()
+        done = 0
+        while not stop.is_set() and (count == 0 or done < count) and (deadline is None or time.time() < deadline):
+            done += 1
+
+            if interval:
+                # latency is measured from the intended start, so a slow server is not hidden
+                # by binds starting late(coordinated omission).
+                now = time.time()
+                if next_start > now:
+                    time.sleep(next_start - now)
+                start = next_start
+                next_start += interval
+            else:
+                start = time.time()
+
+            if pool:
+                account = pool.pick(rng)
+
+            ok = True
+            try:
+                if mode == RECONNECT:
+                    client.connect_bind(account)
+                else:
+                    client.bind(account)
+            except ldap.SERVER_DOWN as e:
+                ok = False
+                logger.debug("server down: %s", e)
+                if mode == REBIND:
+                    client.connect()
+            except ldap.LDAPError as e:
+                ok = False
+                logger.debug("bind failed: %s", e)
+
+            result.record(time.time() - start, ok)
+
+            if mode == RECONNECT:
+                _close(client)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if mode == REBIND:
+            _close(client)
+
+    results.put(result)
+
+
+def bench(server, account, count=1, concurrency=1, mode=RECONNECT, rate=None, duration=None, processes=False,
+          trace_level=ldap_client.DEFAULT_TRACE_LEVEL, trace_sample=None):
+    """run a bind benchmark
+
+    Args:
+        account: an Account, or a CredentialPool to spread binds across many users
+        count: total # of binds, 0 for infinite
+        concurrency: # of workers
+        mode: RECONNECT or REBIND
+        rate: target binds per second of all workers, None for a closed loop
+        duration: seconds to run, None for no limit
+        processes: run workers in processes instead of threads
+        trace_level: python-ldap trace level
+        trace_sample: trace 1 in every # binds of a worker
+
+    Returns:
+        (BindResult, elapsed seconds)
+    """
+    if processes:
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        worker_type = multiprocessing.Process
+    else:
+        stop = threading.Event()
+        results = Queue.Queue()
+        worker_type = threading.Thread
+
+    interval = float(concurrency) / rate if rate else None
+
+    start = time.time()
+    deadline = start + duration if duration else None
+
+    workers = []
+    for idx in range(0, concurrency):
+        # spread the count over the workers
+        n = 0
+        if count:
+            n = count // concurrency + (1 if idx < count % concurrency else 0)
+            if n == 0:
+                continue
+
+        w = worker_type(target=_bind_worker, args=(server, account, n, mode, interval, deadline, stop, results,
+                                                   trace_level, trace_sample))
+        w.daemon = True
+        w.start()
+        workers.append(w)
+
+    total = BindResult()
+    collected = 0
+    try:
+        while collected < len(workers):
+            try:
+                r = results.get(timeout=1)
+            except Queue.Empty:
+                continue
+            total.merge(r)
+            collected += 1
+    except KeyboardInterrupt:
+        stop.set()
+        while collected < len(workers):
+            total.merge(results.get())
+            collected += 1
+
+    elapsed = time.time() - start
+
+    for w in workers:
+        w.join()
+
+    return total, elapsed
+
+
+def bench_async(server, account, count=1, concurrency=1, mode=RECONNECT, rate=None, duration=None,
+                trace_level=ldap_client.DEFAULT_TRACE_LEVEL, trace_sample=None):
+    """run a bind benchmark on async_client connections driven by one dispatcher thread
+
+    A connection has one bind in flight at a time, so `concurrency` is the #
+    of connections.
+
+    Returns:
+        (BindResult, elapsed seconds)
+    """
+    result = BindResult()
+    pool = account if isinstance(account, CredentialPool) else None
+    if trace_sample:
+        result.metrics.add_hook(post=stats.SampledTrace(trace_sample))
+
+    loop = async_client.Loop()
+
+    def _client():
+        c = async_client.AsyncClient(server, loop=loop, metrics=result.metrics, trace_level=trace_level)
+        c.connect()
+        return c
+
+    # connections without a bind in flight
+    idle = Queue.Queue()
+    for _ in range(0, concurrency):
+        idle.put(_client())
+
+    def _done(future, client, start):
+        # on the loop thread, the only one recording results
+        error = future.exception()
+        if error is not None:
+            logger.debug("bind failed: %s", error)
+        result.record(time.time() - start, error is None)
+
+        if mode == RECONNECT or isinstance(error, ldap.SERVER_DOWN):
+            _close(client)
+            try:
+                client = _client()
+            except ldap.LDAPError as e:
+                # always hand a connection back, None is reconnected before the next bind
+                logger.debug("reconnect failed: %s", e)
+                client = None
+        idle.put(client)
+
+    interval = 1.0 / rate if rate else None
+
+    start = time.time()
+    deadline = start + duration if duration else None
+
+    try:
+        next_start = time.time()
+        done = 0
+        while (count == 0 or done < count) and (deadline is None or time.time() < deadline):
+            done += 1
+            client = idle.get()
+            if client is None:
+                client = _client()
+
+            if interval:
+                now = time.time()
+                if next_start > now:
+                    time.sleep(next_start - now)
+                bind_start = next_start
+                next_start += interval
+            else:
+                bind_start = time.time()
+
+            if pool:
+                account = pool.pick()
+
+            client.bind(account).add_done_callback(lambda f, c=client, s=bind_start: _done(f, c, s))
+    except KeyboardInterrupt:
+        pass
+
+    # wait for the binds in flight
+    clients = [idle.get() for _ in range(0, concurrency)]
+    elapsed = time.time() - start
+
+    for c in clients:
+        if c is not None:
+            _close(c)
+    loop.stop()
+
+    return result, elapsed
+
 
 def main(argv=None):
     """Command line options."""
@@ -31,25 +344,82 @@ def main(argv=None):
     parser.add_argument("-D", "--bindDN", help="DN to use to bind to the server.")
     parser.add_argument("-w", "--bindPassword", help="Password to use to bind to the server.")
     parser.add_argument("-c", "--count", type=int, default=1, help="for perf test only, how many logins, 0 for infinite, default 1.")
+    parser.add_argument("-n", "--concurrency", type=int, default=1, help="for perf test only, # of concurrent workers.")
+    parser.add_argument("--processes", action="store_true", default=False,
+                        help="for perf test only, run workers in processes instead of threads.")
+    parser.add_argument("--async", dest="use_async", action="store_true", default=False,
+                        help="for perf test only, keep -n connections binding from one dispatcher thread "
+                             "instead of a worker per connection.")
+    parser.add_argument("--mode", choices=(RECONNECT, REBIND), default=RECONNECT,
+                        help="for perf test only, reconnect on every login, or rebind a persistent connection.")
+    parser.add_argument("--rate", type=float, help="for perf test only, target logins per second, "
+                                                   "default is a closed loop as fast as possible.")
+    parser.add_argument("--duration", type=float, help="for perf test only, seconds to run.")
+    parser.add_argument("--trace-level", type=int, default=ldap_client.DEFAULT_TRACE_LEVEL,
+                        help="python-ldap trace level, 2 dumps every request and response.")
+    parser.add_argument("--trace-sample", type=int, help="trace 1 in every # logins of a worker to stderr.")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="WARNING",
+                        help="log level.")
+    parser.add_argument("--perf", action="store_true", default=False,
+                        help="low overhead mode for perf test, same as --trace-level 0 --log-level WARNING.")
+    parser.add_argument("--stats", choices=("line", "json", "prometheus"),
+                        help="for perf test only, print count and latency of client operations by result code.")
+
+    # credential pool, bind as many users instead of -D
+    parser.add_argument("--dn-file", help="for perf test only, bind as users listed in the file, one dn per line, "
+                                          "as written by sampler.py --dn-file.")
+    parser.add_argument("--prefix", help="for perf test only, bind as users prefix.0 .. prefix.(range - 1) "
+                                         "sampled by sampler.py --prefix.")
+    parser.add_argument("--range", type=int, default=1, help="for perf test only, # of users of --prefix.")
+    parser.add_argument("--tenant", default=basedn.RESERVED_TENANT, help="tenant of the --prefix users.")
+    parser.add_argument("--access", choices=(UNIFORM, ZIPF), default=UNIFORM,
+                        help="for perf test only, how users are picked from --dn-file or --prefix.")
+    parser.add_argument("--zipf-s", type=float, default=1.0, help="for perf test only, exponent of --access zipf.")
+    parser.add_argument("--password", default="1",
+                        help="for perf test only, password shared by the users of --dn-file or --prefix.")
 
     # parse arguments
     args = parser.parse_args()
 
+    if args.perf:
+        args.trace_level = 0
+        args.log_level = "WARNING"
+
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
     ldap_server = ldap_client.Server(None, None, args.uri)
     ldap_account = ldap_client.Account(args.bindDN, args.bindPassword)
-    count = args.count
 
-    # ldap client instance
-    client = ldap_client.Client(ldap_server)
+    dns = None
+    if args.dn_file:
+        dns = [line.strip() for line in open(args.dn_file, 'r') if line.strip()]
+    elif args.prefix:
+        dns = basedn.people_dns(("%s.%s" % (args.prefix, idx) for idx in xrange(0, args.range)), args.tenant)
 
-    if count == 0:
-        while True:
-            client.connect_bind(ldap_account)
+    if dns:
+        # sampled people share one password, -w is the password of -D only
+        ldap_account = CredentialPool(dns, password=args.password, access=args.access, zipf_s=args.zipf_s)
+        logger.info("bind as %s", ldap_account)
+
+    if args.use_async:
+        result, elapsed = bench_async(ldap_server, ldap_account, count=args.count,
+                                      concurrency=max(1, args.concurrency), mode=args.mode, rate=args.rate,
+                                      duration=args.duration, trace_level=args.trace_level,
+                                      trace_sample=args.trace_sample)
     else:
-        for i in xrange(0,count):
-            client.connect_bind(ldap_account)
+        result, elapsed = bench(ldap_server, ldap_account, count=args.count, concurrency=max(1, args.concurrency),
+                                mode=args.mode, rate=args.rate, duration=args.duration, processes=args.processes,
+                                trace_level=args.trace_level, trace_sample=args.trace_sample)
+
+    print "logins: %s, errors: %s, elapsed: %.3fs, throughput: %.1f logins/s" % (
+        result.count, result.errors, elapsed, result.count / elapsed if elapsed else 0)
+    print "latency(ms) of successful logins: %s" % result.latency.summary()
+    if result.errors:
+        print "latency(ms) of failed logins: %s" % result.error_latency.summary()
+    if args.stats:
+        print result.metrics.export(args.stats)
 
-    client.close()
+    return 1 if result.errors else 0
 
 
 if __name__ == "__main__":
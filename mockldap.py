@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+mockldap -- in-process stand-in of a LDAP server
+
+A Directory holds the entries in memory, MockLDAPObject implements the part
+of python-ldap's LDAPObject used by ldap_client, so the client code runs
+unchanged against it, e.g. for benchmarks of the client without a server.
+
+    directory = mockldap.Directory()
+    mockldap.install(directory)   # ldap.initialize returns connections to directory
+
+@author:     FengXi
+"""
+
+import collections
+import datetime
+import logging
+import re
+import threading
+import time
+import uuid
+
+import ldap
+import ldap.dn
+
+logger = logging.getLogger("mockldap")
+
+DEFAULT_SUFFIX = "dc=com"
+DEFAULT_ROOT_DN = "cn=admin,dc=example,dc=com"
+DEFAULT_ROOT_PASSWORD = "admin"
+
+# operational attributes maintained by the directory, returned by '+' or by name
+OPERATIONAL = ('entryUUID', 'createTimestamp', 'modifyTimestamp')
+
+
+def normalize(dn):
+    """the normalized form of a dn, to compare dns"""
+    return ldap.dn.dn2str(ldap.dn.str2dn(dn.lower()))
+
+
+def _parent(norm):
+    rdns = ldap.dn.str2dn(norm)
+    return ldap.dn.dn2str(rdns[1:])
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime("%Y%m%d%H%M%SZ")
+
+
+def _values(val):
+    if val is None:
+        return []
+    if isinstance(val, (list, tuple)):
+        return list(val)
+    return [val]
+
+
+def _unescape(val):
+    return re.sub(r'\\([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), val)
+
+
+class Filter(object):
+    """a parsed LDAP search filter"""
+
+    _ITEM = re.compile(r'^([^=~<>]+)(=|~=|>=|<=)(.*)$')
+
+    def __init__(self, filterstr):
+        self.filterstr = filterstr
+        self._tree, end = self._parse(filterstr.strip(), 0)
+        if end != len(filterstr.strip()):
+            raise ldap.FILTER_ERROR({'desc': "Bad search filter", 'info': filterstr})
+
+    def _parse(self, f, i):
+        if i >= len(f) or f[i] != '(':
+            raise ldap.FILTER_ERROR({'desc': "Bad search filter", 'info': f})
+
+        op = f[i + 1:i + 2]
+        if op in ('&', '|', '!'):
+            children = []
+            i += 2
+            while i < len(f) and f[i] == '(':
+                child, i = self._parse(f, i)
+                children.append(child)
+            if i >= len(f) or f[i] != ')' or (op == '!' and len(children) != 1):
+                raise ldap.FILTER_ERROR({'desc': "Bad search filter", 'info': f})
+            return (op, children), i + 1
+
+        end = f.find(')', i)
+        m = self._ITEM.match(f[i + 1:end]) if end > 0 else None
+        if not m:
+            raise ldap.FILTER_ERROR({'desc': "Bad search filter", 'info': f})
+
+        attr, cmp, val = m.groups()
+        if cmp == '=' and val == '*':
+            return ('present', attr.lower()), end + 1
+        if cmp == '=' and '*' in val:
+            pattern = '.*'.join(re.escape(_unescape(v).lower()) for v in val.split('*'))
+            return ('substr', attr.lower(), re.compile('^%s$' % pattern, re.S)), end + 1
+
+        return (cmp, attr.lower(), _unescape(val).lower()), end + 1
+
+    def match(self, attrs):
+        """match the entry attrs, a dict of lowercased names to values"""
+        return self._match(self._tree, attrs)
+
+    def _match(self, node, attrs):
+        op = node[0]
+        if op == '&':
+            return all(self._match(c, attrs) for c in node[1])
+        if op == '|':
+            return any(self._match(c, attrs) for c in node[1])
+        if op == '!':
+            return not self._match(node[1][0], attrs)
+
+        values = attrs.get(node[1])
+        if not values:
+            return False
+        if op == 'present':
+            return True
+        if op == 'substr':
+            return any(node[2].match(v.lower()) for v in values)
+        if op == '>=':
+            return any(v.lower() >= node[2] for v in values)
+        if op == '<=':
+            return any(v.lower() <= node[2] for v in values)
+
+        # equality and approximate match
+        return any(v.lower() == node[2] for v in values)
+
+
+class Directory(object):
+    """Entries of an in-memory LDAP server, shared by all its connections
+
+    Entries can be added right under a suffix. Every operation sleeps
+    `latency` seconds to stand in for the network and the server.
+    """
+
+    def __init__(self, suffixes=(DEFAULT_SUFFIX,), root_dn=DEFAULT_ROOT_DN, root_password=DEFAULT_ROOT_PASSWORD,
+                 latency=0):
+        self.suffixes = set(normalize(s) for s in suffixes)
+        self.root_dn = root_dn
+        self.root_password = root_password
+        self.latency = latency
+
+        self._lock = threading.RLock()
+        # normalized dn -> (dn, {lowercased name: (name, values)})
+        self._entries = {}
+        # normalized dn -> normalized dns of the children
+        self._children = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, norm, dn):
+        entry = self._entries.get(norm)
+        if entry is None:
+            raise ldap.NO_SUCH_OBJECT({'desc': "No such object", 'matched': '', 'info': dn})
+        return entry
+
+    def bind(self, who, cred):
+        self._wait()
+        if not who:
+            return
+        if who.lower() == self.root_dn.lower() and cred == self.root_password:
+            return
+
+        with self._lock:
+            entry = self._entries.get(normalize(who))
+            if entry is not None and cred in entry[1].get('userpassword', (None, []))[1]:
+                return
+
+        raise ldap.INVALID_CREDENTIALS({'desc': "Invalid credentials"})
+
+    def add(self, dn, modlist):
+        self._wait()
+        norm = normalize(dn)
+        parent = _parent(norm)
+
+        attrs = {}
+        for name, val in modlist:
+            attrs[name.lower()] = (name, _values(val))
+        now = _now()
+        attrs['entryuuid'] = ('entryUUID', [str(uuid.uuid4())])
+        attrs['createtimestamp'] = ('createTimestamp', [now])
+        attrs['modifytimestamp'] = ('modifyTimestamp', [now])
+
+        with self._lock:
+            if norm in self._entries:
+                raise ldap.ALREADY_EXISTS({'desc': "Already exists", 'info': dn})
+            if parent not in self._entries and norm not in self.suffixes and parent not in self.suffixes:
+                raise ldap.NO_SUCH_OBJECT({'desc': "No such object", 'matched': '', 'info': dn})
+
+            self._entries[norm] = (dn, attrs)
+            self._children[parent].add(norm)
+
+    def modify(self, dn, modlist):
+        self._wait()
+        norm = normalize(dn)
+
+        with self._lock:
+            _, attrs = self._get(norm, dn)
+            # all or nothing
+            attrs = dict((k, (name, list(vals))) for k, (name, vals) in attrs.iteritems())
+
+            for op, name, val in modlist:
+                key = name.lower()
+                current = attrs.get(key, (name, []))[1]
+                vals = _values(val)
+
+                if op == ldap.MOD_ADD:
+                    for v in vals:
+                        if v in current:
+                            raise ldap.TYPE_OR_VALUE_EXISTS({'desc': "Type or value exists", 'info': name})
+                    attrs[key] = (name, current + vals)
+                elif op == ldap.MOD_DELETE:
+                    if key not in attrs or any(v not in current for v in vals):
+                        raise ldap.NO_SUCH_ATTRIBUTE({'desc': "No such attribute", 'info': name})
+                    remaining = [v for v in current if v not in vals] if vals else []
+                    attrs[key] = (name, remaining)
+                else:
+                    attrs[key] = (name, vals)
+
+                if not attrs[key][1]:
+                    del attrs[key]
+
+            attrs['modifytimestamp'] = ('modifyTimestamp', [_now()])
+            self._entries[norm] = (self._entries[norm][0], attrs)
+
+    def delete(self, dn):
+        self._wait()
+        norm = normalize(dn)
+
+        with self._lock:
+            self._get(norm, dn)
+            if self._children.get(norm):
+                raise ldap.NOT_ALLOWED_ON_NONLEAF({'desc': "Operation not allowed on non-leaf", 'info': dn})
+
+            del self._entries[norm]
+            self._children.pop(norm, None)
+            self._children[_parent(norm)].discard(norm)
+
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None):
+        self._wait()
+        f = Filter(filterstr or '(objectClass=*)')
+
+        with self._lock:
+            if base == '':
+                # root DSE
+                return [('', {'namingContexts': sorted(self.suffixes), 'supportedControl': []})] \
+                    if scope == ldap.SCOPE_BASE else []
+
+            norm = normalize(base)
+            if norm not in self.suffixes:
+                self._get(norm, base)
+
+            if scope == ldap.SCOPE_BASE:
+                norms = [norm]
+            elif scope == ldap.SCOPE_ONELEVEL:
+                norms = list(self._children.get(norm, ()))
+            else:
+                norms = []
+                stack = [norm]
+                while stack:
+                    n = stack.pop()
+                    norms.append(n)
+                    stack.extend(self._children.get(n, ()))
+
+            results = []
+            for n in norms:
+                entry = self._entries.get(n)
+                if entry is None:
+                    continue
+                dn, attrs = entry
+                if f.match(dict((k, vals) for k, (_, vals) in attrs.iteritems())):
+                    results.append((dn, self._select(attrs, attrlist)))
+
+            return results
+
+    def _select(self, attrs, attrlist):
+        attrlist = [a.lower() for a in attrlist or ['*']]
+        if '1.1' in attrlist and len(attrlist) == 1:
+            return {}
+
+        selected = {}
+        for key, (name, vals) in attrs.iteritems():
+            operational = name in OPERATIONAL
+            if key in attrlist or ('+' in attrlist and operational) or ('*' in attrlist and not operational):
+                selected[name] = list(vals)
+
+        return selected
+
+
+class MockLDAPObject(object):
+    """a connection to a Directory, with the LDAPObject methods used by ldap_client"""
+
+    def __init__(self, directory, uri=None):
+        self.directory = directory
+        self.uri = uri
+        self.who = None
+
+        self._lock = threading.Lock()
+        self._msgid = 0
+        # msgid -> (result type, result data, error), oldest first
+        self._results = collections.OrderedDict()
+
+    def _async(self, rtype, call, *args):
+        try:
+            rdata, error = call(*args), None
+        except ldap.LDAPError as e:
+            rdata, error = None, e
+
+        with self._lock:
+            self._msgid += 1
+            self._results[self._msgid] = (rtype, rdata or [], error)
+            return self._msgid
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        with self._lock:
+            if msgid == ldap.RES_ANY:
+                if not self._results:
+                    return None, None, None, None
+                msgid = next(iter(self._results))
+            if msgid not in self._results:
+                return None, None, None, None
+
+            rtype, rdata, error = self._results.pop(msgid)
+
+        if error is not None:
+            raise error
+        return rtype, rdata, msgid, []
+
+    def result(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        return self.result3(msgid, all, timeout)[:2]
+
+    def set_option(self, option, invalue):
+        pass
+
+    def get_option(self, option):
+        return None
+
+    def simple_bind_s(self, who='', cred='', serverctrls=None, clientctrls=None):
+        self.directory.bind(who, cred)
+        self.who = who
+
+    def simple_bind(self, who='', cred='', serverctrls=None, clientctrls=None):
+        def _bind():
+            self.simple_bind_s(who, cred)
+        return self._async(ldap.RES_BIND, _bind)
+
+    def whoami_s(self, serverctrls=None, clientctrls=None):
+        return "dn:%s" % self.who if self.who else ''
+
+    def unbind_s(self, serverctrls=None, clientctrls=None):
+        self.who = None
+
+    unbind_ext_s = unbind_s
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.directory.search(base, scope, filterstr, attrlist)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                     serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        return self.directory.search(base, scope, filterstr, attrlist)
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                   serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        # a paged search returns all entries in the first page, without a cookie.
+        return self._async(ldap.RES_SEARCH_RESULT, self.directory.search, base, scope, filterstr, attrlist)
+
+    def add_s(self, dn, modlist):
+        self.directory.add(dn, modlist)
+
+    def add_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self.directory.add(dn, modlist)
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._async(ldap.RES_ADD, self.directory.add, dn, modlist)
+
+    def modify_s(self, dn, modlist):
+        self.directory.modify(dn, modlist)
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self.directory.modify(dn, modlist)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._async(ldap.RES_MODIFY, self.directory.modify, dn, modlist)
+
+    def delete_s(self, dn):
+        self.directory.delete(dn)
+
+    def delete_ext_s(self, dn, serverctrls=None, clientctrls=None):
+        self.directory.delete(dn)
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        return self._async(ldap.RES_DELETE, self.directory.delete, dn)
+
+
+def install(directory):
+    """make ldap.initialize return connections to the directory in this process"""
+    def _initialize(uri, trace_level=0, trace_file=None, trace_stack_limit=None, **kwargs):
+        return MockLDAPObject(directory, uri)
+
+    ldap.initialize = _initialize
+
+
+if __name__ == "__main__":
+    pass
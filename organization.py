@@ -6,16 +6,33 @@ org -- Organization CRUD utility
 
 @author:     FengXi
 """
+import collections
 import logging
 
 import basedn
+import entry
 import ldap_client
 import random
+import threading
 import ldap
+import ldap.dn
 
 logger = logging.getLogger("organization")
 _DEBUG = False
 
+# default # of members added or deleted by one modify request
+DEFAULT_CHUNK = 1000
+
+# group sizes picked uniformly from 1 .. max_members
+UNIFORM = "uniform"
+# group sizes of a Pareto distribution, a few huge groups and many small ones
+PARETO = "pareto"
+# shape of the PARETO group sizes, the 80/20 rule
+PARETO_ALPHA = 1.16
+# scale of the PARETO group sizes relative to max_members, the median group
+# is under 1% of max_members and 1 in 25 groups exceeds 15% of it
+PARETO_SCALE = 0.01
+
 
 class Organization(object):
     def __init__(self, dn, name, description):
@@ -34,6 +51,117 @@ class Organization(object):
     __repr__ = __str__
 
 
+class OrgEntry(entry.Entry):
+    """An Organization read from the server, a compact entry.Entry"""
+
+    __slots__ = ()
+
+    # attributes read from the server, in the order of the layout
+    ATTRS = ('cn', 'description', 'uniqueMember')
+
+    @property
+    def name(self):
+        return self.get('cn')
+
+    @property
+    def description(self):
+        return self.get('description')
+
+    @property
+    def members(self):
+        return self.values('uniqueMember')
+
+    def __str__(self):
+        return "dn=%s,name=%s,description=%s" % (self.dn, self.name, self.description)
+
+    __repr__ = __str__
+
+
+class OrgTree(object):
+    """A hierarchy of organizations, grouped by level.
+
+    An organization is the path of its names from the top level one, e.g.
+    ("BeiJing", "HR") for cn=HR,cn=BeiJing.
+    """
+
+    def __init__(self):
+        # levels[0] are the top level organizations
+        self.levels = []
+
+    def add(self, path):
+        while len(self.levels) < len(path):
+            self.levels.append([])
+
+        self.levels[len(path) - 1].append(tuple(path))
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def __str__(self):
+        return "depth=%s,orgs=%s" % (len(self.levels), len(self))
+
+    __repr__ = __str__
+
+    @classmethod
+    def parse(cls, lines):
+        """parse relative DNs of organizations, like the lines of sample/organization.txt"""
+        tree = cls()
+        for line in lines:
+            if line:
+                tree.add([rdn[0][1] for rdn in reversed(basedn.parse(line))])
+
+        return tree
+
+    @classmethod
+    def synthetic(cls, depth, fanout, prefix="org"):
+        """a hierarchy of `depth` levels, every organization has `fanout` children
+
+        Names are the prefix and the index of every level, e.g. org.0.2 is the
+        third child of org.0.
+        """
+        tree = cls()
+        parents = [((), prefix)]
+        for _ in xrange(0, depth):
+            children = []
+            for path, name in parents:
+                for idx in xrange(0, fanout):
+                    child = "%s.%s" % (name, idx)
+                    tree.add(path + (child,))
+                    children.append((path + (child,), child))
+            parents = children
+
+        return tree
+
+    def orgs(self, tenant_name, level):
+        """Organization(s) of a level"""
+        paths = self.levels[level]
+        for path, dn in zip(paths, basedn.v2_org_dns(tenant_name, paths)):
+            yield Organization(dn=dn, name=path[-1], description=path[-1])
+
+
+def _normalize(dn):
+    """the normalized form of a dn, to compare dns"""
+    return ldap.dn.dn2str(ldap.dn.str2dn(dn)).lower()
+
+
+def _parent(dn):
+    """the normalized dn of the parent of a normalized dn"""
+    return basedn.parent(dn)
+
+
+def pick_members(member_choices, max_members=10, distribution=UNIFORM):
+    """pick random members, the group size is of a distribution capped by max_members"""
+    l = min(len(member_choices), max_members)
+
+    if distribution == PARETO:
+        # a Pareto(Lomax) variate from 0, scaled by max_members
+        count = min(l, 1 + int(max_members * PARETO_SCALE * (random.paretovariate(PARETO_ALPHA) - 1)))
+    else:
+        count = random.randint(1, l)
+
+    return random.sample(member_choices, count)
+
+
 class CRUD(object):
     """CRUD operation on a Organization"""
 
@@ -47,6 +175,16 @@ class CRUD(object):
             org: an Organization instance
             tenant_name: tenant name
         """
+        dn, attrs = self.entry(org, members)
+
+        self._client.add_entry(dn, attrs)
+
+    def entry(self, org, members=None):
+        """build the (dn, attrs) of an organization entry
+
+        Args:
+            org: an Organization instance
+        """
         attrs = {}
         attrs['objectclass'] = ['top', 'groupOfUniqueNames']
         attrs["cn"] = org.name
@@ -58,38 +196,345 @@ class CRUD(object):
         else:
             attrs['uniqueMember'] = members
 
-        self._client.add_entry(org.dn, attrs)
+        return org.dn, attrs
 
     def modify_unique_member(self, org_dn, user_dn):
         self._client.replace_one_attr(org_dn, 'uniqueMember', user_dn)
 
+    def add_members(self, org_dn, member_dns, chunk=DEFAULT_CHUNK, window=ldap_client.DEFAULT_WINDOW):
+        """add members to an organization, `chunk` members per MOD_ADD request
+
+        :return: a list of (dn, error) tuples for the requests failed
+        """
+        return self.bulk_add_members([(org_dn, member_dns)], chunk=chunk, window=window)
+
+    def remove_members(self, org_dn, member_dns, chunk=DEFAULT_CHUNK, window=ldap_client.DEFAULT_WINDOW):
+        """remove members from an organization, `chunk` members per MOD_DELETE request
+
+        :return: a list of (dn, error) tuples for the requests failed
+        """
+        return self._modify_members(ldap.MOD_DELETE, [(org_dn, member_dns)], chunk, window)
+
+    def bulk_add_members(self, memberships, chunk=DEFAULT_CHUNK, window=ldap_client.DEFAULT_WINDOW):
+        """add members to many organizations in a pipeline
+
+        A chunk fails as a whole if any of its members is already there.
+
+        Args:
+            memberships: an iterable of (org_dn, member_dns) tuples
+
+        :return: a list of (dn, error) tuples for the requests failed
+        """
+        return self._modify_members(ldap.MOD_ADD, memberships, chunk, window)
+
+    def _modify_members(self, op, memberships, chunk, window):
+        def _mods():
+            for org_dn, member_dns in memberships:
+                for idx in xrange(0, len(member_dns), chunk):
+                    yield org_dn, [(op, 'uniqueMember', member_dns[idx:idx + chunk])]
+
+        return self._client.modify_entries(_mods(), window=window)
+
+    def assign_members(self, org_dns, member_choices, max_members=10, distribution=UNIFORM, chunk=DEFAULT_CHUNK,
+                       window=ldap_client.DEFAULT_WINDOW):
+        """add random members to many organizations in a pipeline, see pick_members
+
+        :return: a list of (dn, error) tuples for the requests failed
+        """
+        return self.bulk_add_members(((dn, pick_members(member_choices, max_members, distribution))
+                                      for dn in org_dns), chunk=chunk, window=window)
+
+    def get_all(self, tenant_name):
+        """get all Organization(s) as OrgEntry(s)"""
+        return list(self.iter_all(tenant_name))
+
+    def iter_all(self, tenant_name, page_size=ldap_client.DEFAULT_PAGE_SIZE):
+        """iterate all Organization(s) of all levels with a paged search"""
+        r = self._client.search_paged(basedn.org_base(tenant_name), scope=ldap.SCOPE_SUBTREE,
+                                      filterstr='(objectClass=groupOfUniqueNames)', attrlist=list(OrgEntry.ATTRS),
+                                      page_size=page_size)
+
+        return entry.compact(r, OrgEntry, OrgEntry.ATTRS)
+
     def delete(self, org):
         """delete an Organization"""
         self._client.recursive_delete(org.dn)
 
-    def sample(self, tenant_name, choices, member_choices):
+    def create_tree(self, tenant_name, tree, members=None, window=ldap_client.DEFAULT_WINDOW):
+        """create the organizations of an OrgTree level by level
+
+        All organizations of a level are added in a pipeline once their
+        parents are created, so the tree is built in about depth round trips.
+
+        Args:
+            tree: an OrgTree
+            members: a callable(Organization) returning the members of an organization
+
+        :return: a list of (dn, error) tuples for the organizations failed to create
+        """
+        failures = []
+        for level in xrange(0, len(tree.levels)):
+            entries = (self.entry(org, members(org) if members else None)
+                       for org in tree.orgs(tenant_name, level))
+            failures.extend(self._client.add_entries(entries, window=window))
+
+        return failures
+
+    def sample(self, tenant_name, choices, member_choices, max_members=10, distribution=UNIFORM,
+               chunk=DEFAULT_CHUNK, window=ldap_client.DEFAULT_WINDOW):
         """sample Organization
+
+        Organizations are created by create_tree, each with up to `chunk`
+        members, the others are added to all organizations in a pipeline of
+        MOD_ADD requests.
+
+        Args:
+            choices: an OrgTree, or relative DNs of organizations, see OrgTree.parse
+
         :return:one list of all orgs_dn
         """
-        def _pick_members():
-            l = len(member_choices)
-            count = random.randint(1, min(l, 10))
-            return random.sample(member_choices, count)
+        tree = choices if isinstance(choices, OrgTree) else OrgTree.parse(choices)
+        rest = []
 
-        for choice in choices:
-            if choice:
-                org = self.line2Org(tenant_name,choice)
-                self.create(org, tenant_name, members=_pick_members())
+        def _members(org):
+            members = pick_members(member_choices, max_members, distribution)
+            if len(members) > chunk:
+                rest.append((org.dn, members[chunk:]))
+            return members[:chunk]
+
+        for dn, e in self.create_tree(tenant_name, tree, _members, window=window):
+            logger.error("failed to create %s: %s", dn, e)
+
+        for dn, e in self.bulk_add_members(rest, chunk=chunk, window=window):
+            logger.error("failed to add members to %s: %s", dn, e)
 
         return
-    
 
-    def line2Org(self,tenant_name,line):
-        name = line.split(',')[0].split('=')[1]
-        dn = line + ',' + basedn.org_base(tenant_name)
-        org = Organization(dn=dn, name=name, description=name)
+    def generate(self, tenant_name, choices, member_choices, max_members=10, distribution=UNIFORM):
+        """generate sampled Organization(s) with random members, level by level
+
+        Args:
+            choices: an OrgTree, or relative DNs of organizations, see OrgTree.parse
+
+        :return: a generator of (Organization, members) tuples
+        """
+        tree = choices if isinstance(choices, OrgTree) else OrgTree.parse(choices)
+        for level in xrange(0, len(tree.levels)):
+            for org in tree.orgs(tenant_name, level):
+                yield org, pick_members(member_choices, max_members, distribution)
+
+
+class MembershipResolver(object):
+    """Transitive organization membership of a tenant, resolved in memory
+
+    All groupOfUniqueNames under the org base are loaded by one paged search
+    into a reverse index of member -> organizations listing it, and a
+    parent -> children index of the DN hierarchy. A member of an
+    organization is a member of its ancestors, and of the organizations
+    listing it as a uniqueMember, transitively.
+
+    refresh() only fetches organizations whose modifyTimestamp is not older
+    than the latest one seen, so the server clock is the only clock used.
+    """
+
+    def __init__(self, ldapclient, tenant_name, page_size=ldap_client.DEFAULT_PAGE_SIZE):
+        self._client = ldapclient
+        self.base = basedn.org_base(tenant_name)
+        self.page_size = page_size
+        # latest modifyTimestamp seen
+        self.last_modified = None
+
+        self._lock = threading.Lock()
+        # all dns below are normalized, see _normalize
+        # organization -> its dn as returned by the server
+        self._dns = {}
+        # organization -> its uniqueMember(s)
+        self._members = {}
+        # member -> organizations listing it
+        self._orgs = collections.defaultdict(set)
+        # organization -> child organizations by dn
+        self._children = collections.defaultdict(set)
+        # organization -> frozenset of itself and all organizations it's in, built on demand
+        self._closure = {}
+
+    def __len__(self):
+        return len(self._dns)
+
+    def __str__(self):
+        return "base=%s,orgs=%s,last_modified=%s" % (self.base, len(self._dns), self.last_modified)
+
+    __repr__ = __str__
+
+    def load(self):
+        """load all organizations, return the # loaded"""
+        with self._lock:
+            self._dns.clear()
+            self._members.clear()
+            self._orgs.clear()
+            self._children.clear()
+            self._closure.clear()
+            self.last_modified = None
+
+        return self._fetch('(objectClass=groupOfUniqueNames)')
+
+    def refresh(self, deletes=True):
+        """fetch organizations modified since the last load/refresh
+
+        Deleted organizations have no modifyTimestamp to find them by, with
+        `deletes` they're found by a search of all dns without attributes.
+
+        :return: # of organizations fetched
+        """
+        if self.last_modified is None:
+            return self.load()
+
+        count = self._fetch('(&(objectClass=groupOfUniqueNames)(modifyTimestamp>=%s))'
+                            % basedn.escape_filter(self.last_modified))
+
+        if deletes:
+            current = set(_normalize(dn) for dn, _ in
+                          self._client.search_paged(self.base, scope=ldap.SCOPE_SUBTREE,
+                                                    filterstr='(objectClass=groupOfUniqueNames)', attrlist=["1.1"],
+                                                    page_size=self.page_size))
+            with self._lock:
+                deleted = [org for org in self._dns if org not in current]
+                for org in deleted:
+                    self._remove(org)
+                if deleted:
+                    self._closure.clear()
+            logger.debug("%s organizations deleted under %s", len(deleted), self.base)
+
+        return count
+
+    def _fetch(self, filterstr):
+        count = 0
+        for dn, attrs in self._client.search_paged(self.base, scope=ldap.SCOPE_SUBTREE, filterstr=filterstr,
+                                                   attrlist=["uniqueMember", "modifyTimestamp"],
+                                                   page_size=self.page_size):
+            org = _normalize(dn)
+            members = set(_normalize(m) for m in attrs.get('uniqueMember', []))
+            modified = attrs.get('modifyTimestamp', [None])[0]
+
+            with self._lock:
+                self._remove(org)
+                self._dns[org] = dn
+                self._members[org] = members
+                for m in members:
+                    self._orgs[m].add(org)
+                self._children[_parent(org)].add(org)
+
+                if modified and (self.last_modified is None or modified > self.last_modified):
+                    self.last_modified = modified
+
+            count += 1
+
+        with self._lock:
+            self._closure.clear()
+
+        logger.info("%s organizations fetched under %s", count, self.base)
+        return count
+
+    def _remove(self, org):
+        """remove an organization from the indexes, must hold the lock"""
+        if org not in self._dns:
+            return
+
+        del self._dns[org]
+        for m in self._members.pop(org, ()):
+            orgs = self._orgs.get(m)
+            if orgs is not None:
+                orgs.discard(org)
+                if not orgs:
+                    del self._orgs[m]
+        self._children[_parent(org)].discard(org)
+
+    def _ancestors(self, org):
+        """frozenset of an organization and all organizations it's in, must hold the lock"""
+        closure = self._closure.get(org)
+        if closure is not None:
+            return closure
+
+        seen = set([org])
+        stack = [org]
+        while stack:
+            o = stack.pop()
+            up = set(self._orgs.get(o, ()))
+            parent = _parent(o)
+            if parent in self._dns:
+                up.add(parent)
+            for u in up:
+                if u not in seen:
+                    seen.add(u)
+                    stack.append(u)
+
+        closure = self._closure[org] = frozenset(seen)
+        return closure
+
+    def orgs_of(self, member_dn, transitive=True):
+        """dns of the organizations a member is in
+
+        Args:
+            member_dn: dn of a user, or of an organization for the ones above it
+        """
+        member = _normalize(member_dn)
+
+        with self._lock:
+            orgs = set(self._orgs.get(member, ()))
+            if member in self._dns:
+                parent = _parent(member)
+                if parent in self._dns:
+                    orgs.add(parent)
+
+            if transitive:
+                for org in list(orgs):
+                    orgs.update(self._ancestors(org))
+                orgs.discard(member)
+
+            return set(self._dns[org] for org in orgs)
+
+    def is_member(self, member_dn, org_dn, transitive=True):
+        """check if a member is in an organization"""
+        member = _normalize(member_dn)
+        org = _normalize(org_dn)
+
+        with self._lock:
+            direct = self._orgs.get(member, ())
+            if org in direct:
+                return True
+            if not transitive:
+                return False
+
+            for o in direct:
+                if org in self._ancestors(o):
+                    return True
+
+            return member in self._dns and org != member and org in self._ancestors(member)
+
+    def members(self, org_dn, transitive=True):
+        """normalized dns of the members of an organization, and of its descendants if transitive"""
+        org = _normalize(org_dn)
+
+        with self._lock:
+            if not transitive:
+                return set(self._members.get(org, ()))
+
+            members = set()
+            seen = set([org])
+            stack = [org]
+            while stack:
+                o = stack.pop()
+                below = set(self._children.get(o, ()))
+                for m in self._members.get(o, ()):
+                    if m in self._dns:
+                        below.add(m)
+                    else:
+                        members.add(m)
+                for b in below:
+                    if b not in seen:
+                        seen.add(b)
+                        stack.append(b)
 
-        return org
+            return members
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+replica -- a local SQLite copy of the people of a tenant
+
+The people are loaded once with a paged search, then only the entries
+modified since the last sync are fetched, so reads like subject.CRUD.get_all
+and exists are served locally instead of by the directory servers.
+
+@author:     FengXi
+"""
+
+import datetime
+import logging
+import sqlite3
+import threading
+
+import basedn
+import entry
+import ldap_client
+import subject
+
+logger = logging.getLogger("replica")
+
+# seconds the modifyTimestamp filter of a sync reaches back before the last
+# one, for the clock skew between the client and the servers
+DEFAULT_OVERLAP = 60
+
+# columns of the people table -> attributes of an inetOrgPerson entry
+_COLUMNS = (('uid', 'uid'), ('given_name', 'givenName'), ('sn', 'sn'), ('mail', 'mail'), ('mobile', 'mobile'),
+            ('tel', 'telephoneNumber'), ('password', 'userPassword'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS people (
+    entry_uuid TEXT PRIMARY KEY,
+    dn TEXT NOT NULL,
+    uid TEXT COLLATE NOCASE,
+    given_name TEXT,
+    sn TEXT,
+    mail TEXT,
+    mobile TEXT,
+    tel TEXT,
+    password TEXT,
+    modify_timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS people_uid ON people (uid);
+CREATE TABLE IF NOT EXISTS sync_state (
+    base TEXT PRIMARY KEY,
+    last_sync TEXT
+);
+"""
+
+
+class PeopleReplica(object):
+    """A SQLite copy of the ou=people entries of a tenant, keyed by entryUUID
+
+    Entries are upserted by entryUUID, so a renamed entry replaces its old
+    row. sync() polls on modifyTimestamp; deleted entries leave no
+    modifyTimestamp behind, with `deletes` they're found by comparing the
+    entryUUIDs of all people of the tenant, which costs a search of every
+    entry, so it's opt-in and better run less often than the polls.
+    """
+
+    def __init__(self, ldapclient, tenant_name, path=':memory:', page_size=ldap_client.DEFAULT_PAGE_SIZE,
+                 overlap=DEFAULT_OVERLAP):
+        self._client = ldapclient
+        self.tenant = tenant_name
+        self.base = basedn.people_base(tenant_name)
+        self.path = path
+        self.page_size = page_size
+        self.overlap = overlap
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.executescript(_SCHEMA)
+
+        row = self._db.execute("SELECT last_sync FROM sync_state WHERE base = ?", (self.base,)).fetchone()
+        # utc datetime the last sync started, None if never loaded
+        self.last_sync = datetime.datetime.strptime(row[0], "%Y%m%d%H%M%SZ") if row and row[0] else None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM people").fetchone()[0]
+
+    def __str__(self):
+        return "base=%s,path=%s,last_sync=%s" % (self.base, self.path, self.last_sync)
+
+    __repr__ = __str__
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def load(self):
+        """replace the local copy with all people, return the # loaded"""
+        started = datetime.datetime.utcnow()
+
+        with self._lock:
+            self._db.execute("DELETE FROM people")
+
+        count = self._fetch('(objectClass=inetOrgPerson)')
+        self._synced(started)
+
+        logger.info("%s people of %s loaded", count, self.base)
+        return count
+
+    def sync(self, deletes=False):
+        """apply the people added or modified since the last sync
+
+        Only the deltas are fetched. With `deletes`, the people deleted are
+        found too, by fetching the entryUUID of every people of the tenant.
+
+        :return: (# of people fetched, # of people deleted)
+        """
+        if self.last_sync is None:
+            return self.load(), 0
+
+        started = datetime.datetime.utcnow()
+        since = ldap_client.convert_datetime_to_generalized_time(
+            self.last_sync - datetime.timedelta(seconds=self.overlap))
+        count = self._fetch('(&(objectClass=inetOrgPerson)(modifyTimestamp>=%s))' % basedn.escape_filter(since))
+
+        deleted = 0
+        if deletes:
+            current = set(attrs['entryUUID'][0] for _, attrs in
+                          self._client.search_paged(self.base, filterstr='(objectClass=inetOrgPerson)',
+                                                    attrlist=["entryUUID"], page_size=self.page_size)
+                          if attrs.get('entryUUID'))
+            with self._lock:
+                gone = [(u,) for u, in self._db.execute("SELECT entry_uuid FROM people") if u not in current]
+                with self._db:
+                    self._db.executemany("DELETE FROM people WHERE entry_uuid = ?", gone)
+            deleted = len(gone)
+
+        self._synced(started)
+
+        logger.debug("%s people of %s fetched, %s deleted", count, self.base, deleted)
+        return count, deleted
+
+    def _fetch(self, filterstr):
+        attrlist = [attr for _, attr in _COLUMNS] + ["entryUUID", "modifyTimestamp"]
+
+        count = 0
+        rows = []
+        for dn, attrs in self._client.search_paged(self.base, filterstr=filterstr, attrlist=attrlist,
+                                                   page_size=self.page_size):
+            if not attrs.get('entryUUID'):
+                logger.warning("%s has no entryUUID, not replicated.", dn)
+                continue
+
+            rows.append(self._row(dn, attrs))
+            if len(rows) >= self.page_size:
+                count += self._upsert(rows)
+                rows = []
+
+        return count + self._upsert(rows)
+
+    def _row(self, dn, attrs):
+        values = [attrs['entryUUID'][0], dn]
+        for _, attr in _COLUMNS:
+            values.append(attrs.get(attr, [None])[0])
+        values.append(attrs.get('modifyTimestamp', [None])[0])
+
+        return values
+
+    def _upsert(self, rows):
+        if rows:
+            with self._lock:
+                with self._db:
+                    self._db.executemany("INSERT OR REPLACE INTO people VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         rows)
+
+        return len(rows)
+
+    def _synced(self, started):
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)",
+                                 (self.base, ldap_client.convert_datetime_to_generalized_time(started)))
+        self.last_sync = started
+
+    def iter_all(self):
+        """iterate all People of the local copy, as subject.PeopleEntry(s)
+
+        Rows are read in batches of page_size by entryUUID, the lock is not
+        held while a batch is consumed.
+        """
+        query = ("SELECT entry_uuid, dn, %s FROM people WHERE entry_uuid > ? ORDER BY entry_uuid LIMIT ?"
+                 % ', '.join(column for column, _ in _COLUMNS))
+        layout = entry.layout(attr for _, attr in _COLUMNS)
+
+        size = max(1, self.page_size)
+        last = ''
+        while True:
+            with self._lock:
+                rows = self._db.execute(query, (last, size)).fetchall()
+
+            for row in rows:
+                yield subject.PeopleEntry(row[1], layout, row[2:])
+
+            if len(rows) < size:
+                break
+
+            last = rows[-1][0]
+
+    def exists(self, username):
+        """check if a user name exists in the local copy, case insensitively"""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM people WHERE uid = ? LIMIT 1", (username,)).fetchone() is not None
+
+    def entry_uuid(self, username):
+        """entryUUID of a user in the local copy, None if it does not exist"""
+        with self._lock:
+            row = self._db.execute("SELECT entry_uuid FROM people WHERE uid = ? LIMIT 1", (username,)).fetchone()
+
+        return row[0] if row else None
+
+
+if __name__ == "__main__":
+    pass
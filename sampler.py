@@ -7,15 +7,187 @@ sampler -- Sampler utility
 """
 
 import logging
+import multiprocessing
+import random
 import sys
 
+import async_client
+import basedn
+import dictstore
+import identity
 import ldap_client
+import ldifdata
+import organization
+import stats
+import tenant
 from argparse import ArgumentParser
 from argparse import ArgumentDefaultsHelpFormatter
 import json
 
 logger = logging.getLogger("sampler")
 
+# per process context of a sampling worker, see _init_worker
+_worker = {}
+
+# distance between the seeds of consecutive tenants, odd so that every tenant
+# index maps to a distinct seed modulo 2**32.
+TENANT_SEED_STRIDE = 0x9E3779B1
+
+
+def partition(count, parts):
+    """split range(count) into at most `parts` disjoint (start, count) ranges"""
+    size, rest = divmod(count, max(1, parts))
+
+    ranges = []
+    start = 0
+    for idx in range(0, parts):
+        n = size + (1 if idx < rest else 0)
+        if n > 0:
+            ranges.append((start, n))
+        start += n
+
+    return ranges
+
+
+def tenant_seed(seed, index, start=0):
+    """seed of the identities of the index-th tenant, from its `start`-th subject
+
+    The first tenant from its first subject is seeded by `seed` itself.
+    """
+    if seed is None:
+        return None
+
+    return (seed + index * TENANT_SEED_STRIDE + start) % 2 ** 32
+
+
+def make_identities(choices, weights=None, seed=None):
+    """an identity.Generator of the name choices, weighted by (firstname_weights, lastname_weights)"""
+    firstname_choices, lastname_choices, username_choices = choices
+    firstname_weights, lastname_weights = weights or (None, None)
+
+    return identity.Generator(firstname_choices, lastname_choices, username_choices,
+                              firstname_weights=firstname_weights, lastname_weights=lastname_weights, seed=seed)
+
+
+def _init_worker(server, account, choices, prefix, window, existing, weights, seed, trace_level, trace_sample,
+                 collect_metrics):
+    """initialize a sampling worker process"""
+    # forked workers share the parent's random state, re-seed to avoid
+    # every worker picking the same random usernames.
+    random.seed()
+
+    _worker['server'] = server
+    _worker['account'] = account
+    _worker['choices'] = choices
+    _worker['prefix'] = prefix
+    _worker['window'] = window
+    _worker['existing'] = existing
+    _worker['weights'] = weights
+    _worker['seed'] = seed
+    _worker['trace_level'] = trace_level
+    _worker['trace_sample'] = trace_sample
+    _worker['collect_metrics'] = collect_metrics
+
+
+def _sample_partition(task):
+    """sample the subjects of one partition on its own connection
+
+    :return: (list of dn of the people created, stats.Metrics of the partition or None)
+    """
+    import subject
+
+    tenant_name, index, start, count = task
+    existing = _worker['existing'].get(tenant_name)
+
+    # every partition gets its own reproducible seed
+    identities = make_identities(_worker['choices'], _worker['weights'], tenant_seed(_worker['seed'], index, start))
+
+    metrics = None
+    if _worker['collect_metrics'] or _worker['trace_sample']:
+        metrics = stats.Metrics()
+        if _worker['trace_sample']:
+            metrics.add_hook(post=stats.SampledTrace(_worker['trace_sample']))
+
+    client = ldap_client.Client(_worker['server'], metrics=metrics, trace_level=_worker['trace_level'])
+    client.connect_bind(_worker['account'])
+    try:
+        dns = subject.CRUD(client).sample(tenant_name, count=count, prefix=_worker['prefix'],
+                                          window=_worker['window'], start=start, existing=existing,
+                                          identities=identities)
+        return dns, client.metrics
+    finally:
+        client.close()
+
+
+def sample_tenants(server, account, counts, choices, prefix=None, window=ldap_client.DEFAULT_WINDOW,
+                   workers=1, existing=None, weights=None, seed=None, metrics=None,
+                   trace_level=ldap_client.DEFAULT_TRACE_LEVEL, trace_sample=None):
+    """sample the subjects of many tenants concurrently in `workers` processes
+
+    A tenant is split into partitions only if there are fewer tenants than
+    workers, otherwise every partition is a whole tenant. Each worker gets
+    its own copy of `existing`, so workers may still collide on random
+    usernames, those adds are reported as failures. Metrics of the workers
+    are merged to `metrics`. trace_sample traces 1 in every # operations.
+
+    Args:
+        counts: a list of (tenant, # of subjects) tuples, see tenant.spread
+        existing: a dict of tenant to its existing usernames, see subject.CRUD.load_usernames
+
+    Returns:
+        a dict of tenant to the list of dn of the people created
+    """
+    parts = max(1, workers // max(1, len(counts)))
+    tasks = [(t, idx, start, n) for idx, (t, count) in enumerate(counts) for start, n in partition(count, parts)]
+
+    pool = multiprocessing.Pool(processes=max(1, min(workers, len(tasks))), initializer=_init_worker,
+                                initargs=(server, account, choices, prefix, window, existing or {}, weights, seed,
+                                          trace_level, trace_sample, metrics is not None))
+    try:
+        results = pool.map(_sample_partition, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    user_dns = dict((t, []) for t, _ in counts)
+    for (t, _, _, _), (dns, worker_metrics) in zip(tasks, results):
+        user_dns[t].extend(dns)
+        if metrics is not None:
+            metrics.merge(worker_metrics)
+
+    return user_dns
+
+
+def export_ldif(out, tenant_name, identities, count, prefix=None, org_choices=None, max_members=10,
+                distribution="uniform"):
+    """write sampled subjects, and organizations if org_choices, to an LDIF stream without a server
+
+    :return: (list of dn of the people, # of entries written)
+    """
+    import subject
+
+    s_crud = subject.CRUD(None)
+    org_crud = organization.CRUD(None)
+
+    user_dns = []
+
+    def _people_entries():
+        # there's no server to search, usernames are only checked against the ones picked.
+        for people in s_crud.generate(tenant_name, count=count, prefix=prefix, existing=set(),
+                                      identities=identities):
+            dn, attrs = s_crud.entry(tenant_name, people)
+            user_dns.append(dn)
+            yield dn, attrs
+
+    written = ldifdata.write(out, _people_entries())
+
+    if org_choices:
+        written += ldifdata.write(out, (org_crud.entry(org, members)
+                                        for org, members in org_crud.generate(tenant_name, org_choices, user_dns,
+                                                                              max_members, distribution)))
+
+    return user_dns, written
+
 
 def main(argv=None):
     """Command line options."""
@@ -40,18 +212,78 @@ def main(argv=None):
 
     parser.add_argument("--chinese", help="Sampler Chinese names #.", action="store_true", default=False)
 
+    parser.add_argument("--seed", help="random seed, the same seed samples the same data.", type=int)
+    parser.add_argument("--weighted", help="pick names by the frequency column of the name dictionaries, "
+                                           "e.g. census \"name frequency cumulative-frequency rank\" files. "
+                                           "the shipped dictionaries have no frequency column.",
+                        action="store_true", default=False)
+
     parser.add_argument("--org", help="Sample organization ?", action="store_true", default=False)
+    parser.add_argument("--org-depth", help="sample a synthetic hierarchy of organizations of the depth, "
+                                            "instead of sample/organization.txt.", type=int)
+    parser.add_argument("--org-fanout", help="# of children of every organization of --org-depth.", type=int,
+                        default=10)
+    parser.add_argument("--max-members", help="max # of members of an organization.", type=int, default=10)
+    parser.add_argument("--member-distribution", help="distribution of the # of members of organizations.",
+                        choices=("uniform", "pareto"), default="uniform")
+    parser.add_argument("--member-chunk", help="# of members added by one modify request.", type=int,
+                        default=1000)
+
+    parser.add_argument("--tenants", help="create # tenants prefix0 .. prefix(# - 1) of --tenant-prefix, "
+                                          "with their ou=people and ou=organization, and spread --subject "
+                                          "over them. default is the existing tenant example only.", type=int)
+    parser.add_argument("--tenant-prefix", help="name prefix of --tenants.", default=tenant.DEFAULT_PREFIX)
+    parser.add_argument("--tenant-skew", help="the k-th tenant gets subjects proportional to 1/k^skew, "
+                                              "0 for an even spread.", type=float, default=0.0)
+
+    parser.add_argument("--clean", help="delete all subjects of the tenant before sampling, "
+                                        "use --subject 0 to clean only.", action="store_true", default=False)
+
+    parser.add_argument("--dn-file", help="write the dn of sampled subjects to the file, one per line, "
+                                          "for login.py --dn-file.")
+
+    parser.add_argument("--ldif", help="write sampled data to the LDIF file instead of the server.")
+    parser.add_argument("--load-ldif", help="add all entries of the LDIF file to the server in a pipeline, "
+                                            "then exit.")
+
+    parser.add_argument("--trace-level", help="python-ldap trace level, 2 dumps every request and response.",
+                        type=int, default=ldap_client.DEFAULT_TRACE_LEVEL)
+    parser.add_argument("--trace-sample", help="trace 1 in every # client operations to stderr.", type=int)
+    parser.add_argument("--log-level", help="log level.", choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        default="WARNING")
+    parser.add_argument("--perf", help="low overhead mode for throughput runs, "
+                                       "same as --trace-level 0 --log-level WARNING.",
+                        action="store_true", default=False)
+
+    parser.add_argument("--stats", help="print count and latency of client operations at the end.",
+                        choices=("line", "json", "prometheus"))
+    parser.add_argument("--stats-interval", help="print a stats line of client operations every # seconds.",
+                        type=float)
+
+    parser.add_argument("--window", help="max # of outstanding add requests.", type=int,
+                        default=ldap_client.DEFAULT_WINDOW)
+    parser.add_argument("--collision", help="how random usernames are checked for existence: "
+                                            "search per username, or load existing usernames once into a set "
+                                            "or a bloom filter.",
+                        choices=("search", "set", "bloom"), default="search")
+    parser.add_argument("--workers", help="# of processes sampling subjects, each on its own connection.", type=int,
+                        default=1)
+    parser.add_argument("--async", dest="use_async", help="create subjects on an asynchronous connection, "
+                                                          "with --window adds in flight.",
+                        action="store_true", default=False)
 
     # parse arguments
     args = parser.parse_args()
+
+    if args.perf:
+        args.trace_level = 0
+        args.log_level = "WARNING"
+
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(name)s %(levelname)s %(message)s")
     ldap_server = ldap_client.Server(args.host, args.port, None)
 
     ldap_account = ldap_client.Account(args.bindDN, args.bindPassword)
 
-    # ldap client instance
-    client = ldap_client.Client(ldap_server)
-    client.connect_bind(ldap_account)
-
     # sample English names
     firstname_dict_file = "sample/census-dist-all-first.txt"
     lastname_dict_file = "sample/census-dist-all-last.txt"
@@ -61,31 +293,148 @@ def main(argv=None):
         firstname_dict_file = "sample/census-dist-all-first-cn.txt"
         lastname_dict_file = "sample/census-dist-all-last-cn.txt"
 
-    firstname_choices = [line.rstrip('\n').strip().title() for line in open(firstname_dict_file, 'r')]
-    lastname_choices = [line.rstrip('\n').strip().title() for line in open(lastname_dict_file, 'r')]
-    username_choices = [line.rstrip('\n').strip().lower() for line in open('sample/usernames.txt', 'r')]
-    org_choices = [line.rstrip('\n').strip() for line in open('sample/organization.txt', 'r')]
+    # memory-mapped, words are read on demand.
+    firstname_choices = dictstore.Dictionary(firstname_dict_file, str.title)
+    lastname_choices = dictstore.Dictionary(lastname_dict_file, str.title)
+    username_choices = dictstore.Dictionary('sample/usernames.txt', str.lower)
+    firstname_weights = lastname_weights = None
+    if args.weighted:
+        try:
+            firstname_weights = firstname_choices.weights()
+            lastname_weights = lastname_choices.weights()
+        except ValueError as e:
+            parser.error("--weighted needs name dictionaries with a frequency column, %s" % e)
+    choices = (firstname_choices, lastname_choices, username_choices)
+    weights = (firstname_weights, lastname_weights)
+    if args.org_depth:
+        org_choices = organization.OrgTree.synthetic(args.org_depth, args.org_fanout)
+    else:
+        org_choices = organization.OrgTree.parse(line.rstrip('\n').strip()
+                                                 for line in open('sample/organization.txt', 'r'))
 
     # sample people/org data.
-    all_tenants = ("example",)
+    if args.tenants:
+        all_tenants = tenant.names(args.tenants, args.tenant_prefix)
+    else:
+        all_tenants = [basedn.RESERVED_TENANT]
+    counts = tenant.spread(args.subject, all_tenants, args.tenant_skew)
+
+    if args.ldif:
+        dn_file = open(args.dn_file, 'w') if args.dn_file else None
+        with open(args.ldif, 'w') as out:
+            for idx, (t, count) in enumerate(counts):
+                if args.tenants:
+                    ldifdata.write(out, tenant.CRUD(None).entries(t))
+                user_dns, written = export_ldif(out, t, make_identities(choices, weights, tenant_seed(args.seed, idx)),
+                                                count, prefix=args.prefix,
+                                                org_choices=org_choices if args.org else None,
+                                                max_members=args.max_members,
+                                                distribution=args.member_distribution)
+                print "wrote %s entries of tenant %s to %s" % (written, t, args.ldif)
+
+                if dn_file:
+                    for dn in user_dns:
+                        dn_file.write(dn + '\n')
+        if dn_file:
+            dn_file.close()
+        return
+
+    # ldap client instance, operations are measured only if asked to.
+    metrics = None
+    reporter = None
+    if args.stats or args.stats_interval or args.trace_sample:
+        metrics = stats.Metrics()
+        if args.trace_sample:
+            metrics.add_hook(post=stats.SampledTrace(args.trace_sample))
+        if args.stats_interval:
+            reporter = metrics.start_reporter(args.stats_interval)
+
+    client = ldap_client.Client(ldap_server, metrics=metrics, trace_level=args.trace_level)
+    client.connect_bind(ldap_account)
+
+    if args.load_ldif:
+        with open(args.load_ldif, 'r') as inp:
+            failures = ldifdata.load(client, inp, window=args.window)
+        for dn, e in failures:
+            logger.error("failed to add %s: %s", dn, e)
+        client.close()
+        _report(metrics, reporter, args.stats)
+        return 1 if failures else 0
+
     import subject
-    import organization
 
     s_crud = subject.CRUD(client)  # subject crud client
+    creator = None
+    if args.use_async:
+        creator = async_client.AsyncClient(ldap_server, metrics=metrics, trace_level=args.trace_level)
+        creator.connect_bind(ldap_account).result()
     org_crud = organization.CRUD(client)  # organization crud client
 
+    dn_file = open(args.dn_file, 'w') if args.dn_file else None
+
+    def _progress(deleted, seconds):
+        print "deleted %s people in %.1fs, %.1f/s" % (deleted, seconds, deleted / seconds if seconds else 0)
+
+    if args.tenants:
+        failures = tenant.CRUD(client).bulk_create(all_tenants, window=args.window)
+        for dn, e in failures:
+            logger.error("failed to create %s: %s", dn, e)
+
+    existing = {}
     for t in all_tenants:
-        # then create sample subject.
-        user_dns = s_crud.sample(t, firstname_choices=firstname_choices, lastname_choices=lastname_choices,
-                                 username_choices=username_choices, count=args.subject,
-                                 prefix=args.prefix)
+        if args.clean:
+            failures = s_crud.bulk_clean(t, window=args.window, progress=_progress)
+            for dn, e in failures:
+                logger.error("failed to delete %s: %s", dn, e)
+
+        # load existing usernames once instead of a search per random username.
+        if not args.prefix and args.collision != "search":
+            existing[t] = s_crud.load_usernames(t, use_bloom=args.collision == "bloom")
+
+    # then create sample subject, tenants are sampled concurrently by the workers.
+    tenant_dns = None
+    if args.workers > 1:
+        tenant_dns = sample_tenants(ldap_server, ldap_account, counts, choices, prefix=args.prefix,
+                                    window=args.window, workers=args.workers, existing=existing,
+                                    weights=weights, seed=args.seed, metrics=metrics,
+                                    trace_level=args.trace_level, trace_sample=args.trace_sample)
+
+    for idx, (t, count) in enumerate(counts):
+        if tenant_dns is not None:
+            user_dns = tenant_dns[t]
+        else:
+            user_dns = s_crud.sample(t, count=count, prefix=args.prefix, window=args.window,
+                                     existing=existing.get(t),
+                                     identities=make_identities(choices, weights, tenant_seed(args.seed, idx)),
+                                     creator=creator)
+
+        if dn_file:
+            for dn in user_dns:
+                dn_file.write(dn + '\n')
 
         # create organizations                    
         if args.org:
-            org_crud.sample(t, org_choices, user_dns)
+            org_crud.sample(t, org_choices, user_dns, max_members=args.max_members,
+                            distribution=args.member_distribution, chunk=args.member_chunk, window=args.window)
         
+    if dn_file:
+        dn_file.close()
+
+    if creator:
+        creator.close()
     client.close()
 
+    _report(metrics, reporter, args.stats)
+
+
+def _report(metrics, reporter, fmt):
+    """stop the periodic reporter and print the final stats"""
+    if reporter:
+        reporter.set()
+
+    if fmt:
+        print metrics.export(fmt)
+
 
 if __name__ == "__main__":
     sys.exit(main())
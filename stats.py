@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+stats -- latency statistics for the perf utilities
+
+@author:     FengXi
+"""
+
+import itertools
+import json
+import math
+import sys
+import threading
+import time
+
+
+class Histogram(object):
+    """An HDR-style latency histogram.
+
+    Values are recorded in microseconds into log-linear buckets, each power of
+    two is split into 2^(precision - 1) sub buckets, so a percentile is off by
+    less than 1/2^(precision - 1) whatever the magnitude of the value.
+    """
+
+    # percentiles reported by summary()
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, precision=9):
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.precision)
+        return (shift << self.precision) + (value >> shift)
+
+    def _value(self, index):
+        """the highest value of a bucket"""
+        shift = index >> self.precision
+        sub = index & ((1 << self.precision) - 1)
+        return ((sub + 1) << shift) - 1
+
+    def record(self, seconds):
+        """record a latency in seconds"""
+        self.record_value(int(seconds * 1000000))
+
+    def record_value(self, value):
+        """record a latency in microseconds"""
+        value = max(0, value)
+
+        idx = self._index(value)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """add all values of another histogram of the same precision"""
+        for idx, n in other.counts.iteritems():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+
+        self.count += other.count
+        self.total += other.total
+
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """the value in microseconds at percentile p(0-100)"""
+        if self.count == 0:
+            return 0
+
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(self._value(idx), self.max)
+
+        return self.max
+
+    def mean(self):
+        """the mean value in microseconds"""
+        if self.count == 0:
+            return 0
+
+        return float(self.total) / self.count
+
+    def summary(self):
+        """a one line summary in milliseconds"""
+        parts = ["min=%.3f" % ((self.min or 0) / 1000.0), "mean=%.3f" % (self.mean() / 1000.0)]
+        for p in self.PERCENTILES:
+            parts.append("p%s=%.3f" % (p, self.percentile(p) / 1000.0))
+        parts.append("max=%.3f" % (self.max / 1000.0))
+
+        return ' '.join(parts)
+
+    def __str__(self):
+        return "count=%s,%s" % (self.count, self.summary())
+
+    __repr__ = __str__
+
+
+# result code of a successful operation
+SUCCESS = "SUCCESS"
+
+
+class Metrics(object):
+    """Client-side operation metrics
+
+    Count and latency of operations are recorded per operation type(bind,
+    add, search, modify, delete) and result code, the name of the LDAPError
+    raised or SUCCESS. Pre hooks are called as hook(op, dn) before an
+    operation, post hooks as hook(op, dn, seconds, code) after it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (op, code) -> Histogram
+        self._latency = {}
+        self.pre_hooks = []
+        self.post_hooks = []
+
+    def __getstate__(self):
+        # hooks and lock are per process
+        return {'_latency': self._latency}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._latency = state['_latency']
+
+    def add_hook(self, pre=None, post=None):
+        if pre:
+            self.pre_hooks.append(pre)
+        if post:
+            self.post_hooks.append(post)
+
+    def start(self, op, dn=None):
+        """an operation starts, return its start time"""
+        for hook in self.pre_hooks:
+            hook(op, dn)
+
+        return time.time()
+
+    def finish(self, op, dn, start, code=SUCCESS):
+        """an operation started at `start` finishes with a result code"""
+        seconds = time.time() - start
+        self.record(op, seconds, code)
+
+        for hook in self.post_hooks:
+            hook(op, dn, seconds, code)
+
+    def record(self, op, seconds, code=SUCCESS):
+        with self._lock:
+            h = self._latency.get((op, code))
+            if h is None:
+                h = self._latency[(op, code)] = Histogram()
+            h.record(seconds)
+
+    def merge(self, other):
+        with self._lock:
+            for key, h in other._latency.iteritems():
+                if key not in self._latency:
+                    self._latency[key] = Histogram(h.precision)
+                self._latency[key].merge(h)
+
+    def snapshot(self):
+        """a copy of the latency histograms by (op, code)"""
+        with self._lock:
+            copy = {}
+            for key, h in self._latency.iteritems():
+                copy[key] = Histogram(h.precision)
+                copy[key].merge(h)
+            return copy
+
+    def ops(self):
+        """latency of all results of every op, by op"""
+        ops = {}
+        for (op, _), h in self.snapshot().iteritems():
+            if op not in ops:
+                ops[op] = Histogram(h.precision)
+            ops[op].merge(h)
+
+        return ops
+
+    def line(self):
+        """a one line summary of all ops"""
+        latency = self.snapshot()
+        parts = []
+        for op, h in sorted(self.ops().iteritems()):
+            errors = h.count - (latency[(op, SUCCESS)].count if (op, SUCCESS) in latency else 0)
+            parts.append("%s: count=%s errors=%s p50=%.3f p99=%.3f" % (
+                op, h.count, errors, h.percentile(50) / 1000.0, h.percentile(99) / 1000.0))
+
+        return '; '.join(parts)
+
+    def to_dict(self):
+        result = {}
+        for (op, code), h in sorted(self.snapshot().iteritems()):
+            stats = result.setdefault(op, {'count': 0, 'errors': 0, 'codes': {}})
+            stats['count'] += h.count
+            if code != SUCCESS:
+                stats['errors'] += h.count
+
+            codes = {'count': h.count, 'mean_ms': h.mean() / 1000.0, 'max_ms': h.max / 1000.0}
+            for p in Histogram.PERCENTILES:
+                codes["p%s_ms" % p] = h.percentile(p) / 1000.0
+            stats['codes'][code] = codes
+
+        return result
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def to_prometheus(self, prefix="ldap_client"):
+        """metrics in the Prometheus text exposition format"""
+        latency = sorted(self.snapshot().iteritems())
+
+        lines = ["# TYPE %s_operations_total counter" % prefix]
+        for (op, code), h in latency:
+            lines.append('%s_operations_total{op="%s",code="%s"} %s' % (prefix, op, code, h.count))
+
+        lines.append("# TYPE %s_operation_latency_seconds summary" % prefix)
+        for (op, code), h in latency:
+            labels = 'op="%s",code="%s"' % (op, code)
+            for p in Histogram.PERCENTILES:
+                lines.append('%s_operation_latency_seconds{%s,quantile="%s"} %s' % (
+                    prefix, labels, p / 100.0, h.percentile(p) / 1000000.0))
+            lines.append('%s_operation_latency_seconds_sum{%s} %s' % (prefix, labels, h.total / 1000000.0))
+            lines.append('%s_operation_latency_seconds_count{%s} %s' % (prefix, labels, h.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, fmt):
+        """metrics in a format: line, json or prometheus"""
+        if fmt == "json":
+            return self.to_json()
+        if fmt == "prometheus":
+            return self.to_prometheus()
+
+        return self.line()
+
+    def start_reporter(self, interval, out=sys.stderr):
+        """write a stats line every interval seconds in a daemon thread
+
+        :return: an Event, set it to stop the reporter
+        """
+        stop = threading.Event()
+
+        def _report():
+            while not stop.wait(interval):
+                out.write("%s %s\n" % (time.strftime("%H:%M:%S"), self.line()))
+                out.flush()
+
+        t = threading.Thread(target=_report)
+        t.daemon = True
+        t.start()
+
+        return stop
+
+
+class SampledTrace(object):
+    """A post hook of Metrics tracing 1 in every n operations"""
+
+    def __init__(self, n, out=sys.stderr):
+        self.n = max(1, n)
+        self.out = out
+        self._seq = itertools.count()
+
+    def __call__(self, op, dn, seconds, code):
+        if next(self._seq) % self.n == 0:
+            self.out.write("%s %s %s %.3fms %s\n" % (time.strftime("%H:%M:%S"), op, dn, seconds * 1000, code))
+
+
+if __name__ == "__main__":
+    pass
@@ -7,16 +7,22 @@ subject -- Subject CRUD utility
 """
 
 import basedn
+import bloom
+import entry
+import identity
+import ldap_client
 import logging
 import time
-import random
-import string
 import uuid
 import datetime
 import ldap
+import ldap.dn
 
 logger = logging.getLogger("subject")
 
+# default expected # of usernames of a bloom filter, see CRUD.load_usernames
+BLOOM_CAPACITY = 10000000
+
 
 class Subject(object):
     def __init__(self, username):
@@ -48,11 +54,49 @@ class People(Subject):
 
     __repr__ = __str__
 
+def _attr(name):
+    return property(lambda self: self.get(name))
+
+
+class PeopleEntry(entry.Entry):
+    """A People read from the server, a compact entry.Entry with the attributes of People"""
+
+    __slots__ = ()
+
+    # attributes read from the server, in the order of the layout
+    ATTRS = ('uid', 'givenName', 'sn', 'mail', 'mobile', 'telephoneNumber', 'userPassword')
+
+    username = _attr('uid')
+    first_name = _attr('givenName')
+    last_name = _attr('sn')
+    email = _attr('mail')
+    mobile = _attr('mobile')
+    tel = _attr('telephoneNumber')
+    pwd = _attr('userPassword')
+
+    def __str__(self):
+        return "%s,%s,%s" % (self.username, self.first_name, self.last_name)
+
+    __repr__ = __str__
+
+
 class CRUD(object):
-    """CRUD operation on a Subject"""
+    """CRUD operation on a Subject
+
+    With a replica.PeopleReplica, get_all, iter_all and exists of its tenant
+    are served by the local copy instead of the server.
+    """
 
-    def __init__(self, ldapclient):
+    def __init__(self, ldapclient, replica=None):
         self._client = ldapclient
+        self._replica = replica
+
+    def _local(self, tenant_name):
+        """the replica of a tenant, None if it's not replicated"""
+        if self._replica is not None and self._replica.tenant == tenant_name:
+            return self._replica
+
+        return None
 
     def is_ascii(self, s):
         return all(ord(c) < 128 for c in s)
@@ -60,6 +104,30 @@ class CRUD(object):
     def create(self, tenant, people):
         """create a people
 
+        Args:
+            peole: a People instance
+        """
+        dn, attrs = self.entry(tenant, people)
+
+        self._client.add_entry(dn, attrs)
+
+    def bulk_create(self, tenant, peoples, window=ldap_client.DEFAULT_WINDOW, creator=None):
+        """create many people in a pipeline
+
+        Args:
+            peoples: an iterable of People instances
+            window: max # of outstanding add requests
+            creator: client adding the entries, e.g. an async_client.AsyncClient, default the CRUD client
+
+        Returns:
+            a list of (dn, error) tuples for the people failed to create
+        """
+        entries = (self.entry(tenant, p) for p in peoples)
+        return (creator or self._client).add_entries(entries, window=window)
+
+    def entry(self, tenant, people):
+        """build the (dn, attrs) of a people entry
+
         Args:
             peole: a People instance
         """
@@ -88,7 +156,7 @@ class CRUD(object):
         # attrs['mobileTelephoneNumber'] = [people.mobile]
         attrs['mobile'] = [people.mobile]
 
-        self._client.add_entry(dn, attrs)
+        return dn, attrs
 
     def delete(self, username, tenant_name):
         """delete a Subject"""
@@ -96,89 +164,198 @@ class CRUD(object):
         self._client.delete_entry(dn)
 
     def get_all(self, tenant_name):
-        """get all People(s)"""
-        base = basedn.people_base(tenant_name)
-        r = self._client.search(base, filterstr='(objectClass=inetOrgPerson)', attrlist=["*"])
+        """get all People(s) as PeopleEntry(s)"""
+        return list(self.iter_all(tenant_name))
 
-        peoples = []
-        for _, entry in r:
-            p = People(entry.get("uid")[0], entry.get("givenName")[0], entry.get("sn")[0],
-                       entry.get("mail")[0], entry.get("mobile")[0], entry.get("telephoneNumber")[0],
-                       entry.get("userPassword")[0])
-            peoples.append(p)
+    def iter_all(self, tenant_name, page_size=ldap_client.DEFAULT_PAGE_SIZE):
+        """iterate all People(s) with a paged search, page_size People(s) are held in memory at a time"""
+        if self._local(tenant_name):
+            return self._local(tenant_name).iter_all()
 
-        return peoples
+        return self._iter_all(tenant_name, page_size)
+
+    def _iter_all(self, tenant_name, page_size):
+        base = basedn.people_base(tenant_name)
+        r = self._client.search_paged(base, filterstr='(objectClass=inetOrgPerson)',
+                                      attrlist=list(PeopleEntry.ATTRS), page_size=page_size)
+
+        return entry.compact(r, PeopleEntry, PeopleEntry.ATTRS)
 
     def exists(self, tenant_name, username):
         """check if a user name exists"""
+        if self._local(tenant_name):
+            return self._local(tenant_name).exists(username)
+
         base = basedn.people_base(tenant_name)
-        r = self._client.search(base, filterstr='(&(objectClass=inetorgperson)(uid=%s))' % basedn.escape(username),
-                                attrlist=["1.1"])
+        filterstr = '(&(objectClass=inetorgperson)(uid=%s))' % basedn.escape_filter(username)
+        r = self._client.search(base, filterstr=filterstr, attrlist=["1.1"])
 
         return len(r) > 0
 
+    def exists_many(self, tenant_name, usernames, chunk=ldap_client.DEFAULT_BATCH, window=ldap_client.DEFAULT_WINDOW):
+        """check which user names exist
+
+        Up to `chunk` user names are checked by a single OR-filter search, the
+        searches are sent in a pipeline.
+
+        Raises the error of the first search failed.
+
+        :return: set of the user names exist
+        """
+        base = basedn.people_base(tenant_name)
+        usernames = list(usernames)
+
+        filters = ('(&(objectClass=inetorgperson)%s)' % basedn.or_filter('uid', usernames[idx:idx + chunk])
+                   for idx in xrange(0, len(usernames), chunk))
+        entries, failures = self._client.search_many(base, filters, scope=ldap.SCOPE_SUBTREE, attrlist=["1.1"],
+                                                     window=window)
+        if failures:
+            raise failures[0][1]
+
+        # only dn are returned, uid is the rdn of a people
+        found = set(ldap.dn.str2dn(dn)[0][0][1].lower() for dn, _ in entries)
+
+        return set(u for u in usernames if u.lower() in found)
+
+    def load_usernames(self, tenant_name, use_bloom=False, capacity=BLOOM_CAPACITY,
+                       page_size=ldap_client.DEFAULT_PAGE_SIZE):
+        """load the usernames of all People once with a paged search
+
+        Args:
+            use_bloom: keep the usernames in a bloom.BloomFilter instead of a set, for very large tenants
+            capacity: expected # of usernames of the bloom filter, including the ones to be sampled
+
+        Returns:
+            a set or a bloom.BloomFilter of the usernames, lowercased
+        """
+        base = basedn.people_base(tenant_name)
+
+        usernames = bloom.BloomFilter(capacity) if use_bloom else set()
+        for _, entry in self._client.search_paged(base, scope=ldap.SCOPE_SUBTREE,
+                                                  filterstr='(objectClass=inetOrgPerson)', attrlist=["uid"],
+                                                  page_size=page_size):
+            # uid matches case-insensitively, the candidates are lowercased too.
+            for uid in entry.get("uid", []):
+                usernames.add(uid.lower())
+
+        return usernames
+
     def clean(self, tenant_name):
-        """delete all People"""
+        """delete all People one at a time
 
-        all_people = self.get_all(tenant_name)
-        for p in all_people:
-            self.delete(p.username, tenant_name)
+        The server's People are deleted, a replica may lag behind. The deletes
+        run on the connection of the paged search, see bulk_clean.
 
-    def sample(self, tenant_name, firstname_choices=None, lastname_choices=None, username_choices=None, count=10,
-               prefix=None):
-        """sample subject"""
-        # if len(username_choices) < count:
-        #    padding_count = count - len(username_choices)
-        #    for idx in range(0,padding_count):
-        #        username_choices.append("padding-user-%s-%s" % (int(round(time.time())), idx))
-
-        def _pick_one_username():
-            candidate = random.choice(username_choices)
-            while True:
-                if not self.exists(tenant_name, candidate):
-                    return candidate
-                else:
-                    candidate = "%s_%s_%s" % (candidate, int(round(time.time())), random.random())
+        Raises the error of the first People failed to delete.
+        """
+        failures = self.bulk_clean(tenant_name, window=1)
+        if failures:
+            raise failures[0][1]
+
+    def bulk_clean(self, tenant_name, window=ldap_client.DEFAULT_WINDOW, page_size=ldap_client.DEFAULT_PAGE_SIZE,
+                   progress=None, progress_every=10000):
+        """delete all People in a pipeline
+
+        Only the dn of People are fetched, page by page, and deleted with up to
+        `window` outstanding delete requests.
 
-        def _pick_one_firstname():
-            return random.choice(firstname_choices)
+        Args:
+            progress: a callable(deleted, seconds) called every `progress_every` deletes and once at the end
+
+        Returns:
+            a list of (dn, error) tuples for the People failed to delete
+        """
+        start = time.time()
+        deleted = [0]
 
-        def _pick_one_lastname():
-            return random.choice(lastname_choices)
+        def _deleted():
+            deleted[0] += 1
+            if progress and deleted[0] % progress_every == 0:
+                progress(deleted[0], time.time() - start)
 
-        def _pick_one_tel():
-            length = random.choice([8, 9, 10, 11, 12])
+        failures = self._client.delete_search(basedn.people_base(tenant_name), filterstr='(objectClass=inetOrgPerson)',
+                                              window=window, page_size=page_size, on_deleted=_deleted)
 
-            return ''.join(random.choice(string.digits) for _ in range(length))
+        if progress:
+            progress(deleted[0], time.time() - start)
 
+        return failures
+
+    def sample(self, tenant_name, firstname_choices=None, lastname_choices=None, username_choices=None, count=10,
+               prefix=None, window=ldap_client.DEFAULT_WINDOW, start=0, existing=None, identities=None,
+               creator=None):
+        """sample subject
+
+        People are generated by generate() and created in a pipeline of
+        `window` outstanding add requests, by `creator` if given.
+
+        :return: list of dn of the people created
+        """
         dn_list = []
-        for idx in range(0, count):
-            # do not randomize username, simply append an index to a fixed prefix.
-            if prefix:
-                username = "%s.%s" % (prefix, idx)
-                first_name = "%s_fn.%s" % (prefix, idx)
-                last_name = "%s_ln.%s" % (prefix, idx)
-            else:
-                username = _pick_one_username()
-                first_name = _pick_one_firstname()
-                last_name = _pick_one_lastname()
-
-            email = "%s@mailinator.com" % username
-            mobile = _pick_one_tel()
-            tel = _pick_one_tel()
-
-            pwd = "1"
-
-            # create people
-            people = People(username=username, first_name=first_name, last_name=last_name, email=email,
-                            mobile=mobile, tel=tel, pwd=pwd)
-            self.create(tenant_name, people)
-
-            dn = people.dn(tenant_name)
-            dn_list.append(dn)
+
+        def _people():
+            for people in self.generate(tenant_name, firstname_choices=firstname_choices,
+                                        lastname_choices=lastname_choices, username_choices=username_choices,
+                                        count=count, prefix=prefix, start=start, existing=existing,
+                                        identities=identities):
+                dn_list.append(people.dn(tenant_name))
+
+                yield people
+
+        # create people
+        failures = self.bulk_create(tenant_name, _people(), window=window, creator=creator)
+        for dn, e in failures:
+            logger.error("failed to create %s: %s", dn, e)
+
+        if failures:
+            failed = set(dn for dn, _ in failures)
+            dn_list = [dn for dn in dn_list if dn not in failed]
 
         return dn_list
 
+    def generate(self, tenant_name, firstname_choices=None, lastname_choices=None, username_choices=None, count=10,
+                 prefix=None, start=0, existing=None, identities=None, chunk=10000):
+        """generate sampled People
+
+        With a prefix, usernames are prefix.start .. prefix.(start + count - 1).
+
+        Random usernames are checked against `existing`, a set or bloom filter
+        returned by load_usernames, and it's updated as usernames are picked.
+        Without it, each candidate is checked with a search.
+
+        Identities are generated in batches of `chunk` by `identities`, an
+        identity.Generator, e.g. a seeded one. By default it's an unseeded
+        generator of the name choices.
+        """
+        if identities is None:
+            identities = identity.Generator(firstname_choices, lastname_choices, username_choices)
+
+        # lowercased usernames known to exist or picked in this run, the adds may be still in flight.
+        picked = existing if existing is not None else set()
+
+        def _pick_one_username(candidate):
+            while True:
+                key = candidate.lower()
+                if key not in picked and (existing is not None or not self.exists(tenant_name, candidate)):
+                    picked.add(key)
+                    return candidate
+                else:
+                    candidate = identities.suffix(candidate)
+
+        for offset in xrange(0, count, chunk):
+            size = min(chunk, count - offset)
+            batch = identities.batch(size, prefix=prefix, start=start + offset)
+
+            for idx in xrange(0, size):
+                username = batch['username'][idx]
+                # do not randomize username, simply append an index to a fixed prefix.
+                if not prefix:
+                    username = _pick_one_username(username)
+
+                yield People(username=username, first_name=batch['first_name'][idx],
+                             last_name=batch['last_name'][idx], email="%s@mailinator.com" % username,
+                             mobile=batch['mobile'][idx], tel=batch['tel'][idx], pwd="1")
+
 
 if __name__ == "__main__":
     pass
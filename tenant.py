@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+tenant -- Tenant CRUD utility
+
+A tenant is the base entry dc=<tenant>,dc=com, with ou=people for its
+subjects and ou=organization for its organizations.
+
+@author:     FengXi
+"""
+
+import basedn
+import ldap
+import ldap_client
+import logging
+
+logger = logging.getLogger("tenant")
+
+# tenant names are prefix0, prefix1, ...
+DEFAULT_PREFIX = "tenant"
+
+
+def names(count, prefix=DEFAULT_PREFIX):
+    """names of `count` tenants"""
+    return ["%s%s" % (prefix, idx) for idx in xrange(0, count)]
+
+
+def spread(count, tenants, skew=0.0):
+    """spread `count` users over the tenants
+
+    The k-th tenant gets a share proportional to 1/k^skew, i.e. even for
+    skew 0, and a few large tenants with a long tail of small ones for skew
+    around 1. Shares are rounded by the largest remainder, so they sum up
+    to count.
+
+    Returns:
+        a list of (tenant, # of users) tuples
+    """
+    if not tenants:
+        return []
+
+    weights = [1.0 / (k ** skew) for k in xrange(1, len(tenants) + 1)]
+    total = sum(weights)
+
+    exact = [count * w / total for w in weights]
+    counts = [int(e) for e in exact]
+
+    # hand out the rest to the largest remainders
+    rest = count - sum(counts)
+    for idx in sorted(xrange(0, len(tenants)), key=lambda i: counts[i] - exact[i])[:rest]:
+        counts[idx] += 1
+
+    return zip(tenants, counts)
+
+
+class CRUD(object):
+    """CRUD operation on a tenant"""
+
+    def __init__(self, ldapclient):
+        self._client = ldapclient
+
+    def entries(self, tenant):
+        """the (dn, attrs) of the base entry of a tenant and its ou entries, parents first"""
+        return [
+            (basedn.tenant_base(tenant), {'objectclass': ['top', 'domain'], 'dc': tenant}),
+            (basedn.people_base(tenant), self._ou('people', "people of %s" % tenant)),
+            (basedn.org_base(tenant), self._ou('organization', "organizations of %s" % tenant)),
+        ]
+
+    def _ou(self, name, description):
+        return {'objectclass': ['top', 'organizationalUnit'], 'ou': name, 'description': description}
+
+    def create(self, tenant):
+        """create a tenant, entries already existing are kept"""
+        base, attrs = self.entries(tenant)[0]
+
+        self._create(self._client.add_entry, base, attrs)
+        self._create(self._client.create_ou, basedn.people_base(tenant), 'people', "people of %s" % tenant)
+        self._create(self._client.create_ou, basedn.org_base(tenant), 'organization', "organizations of %s" % tenant)
+
+    def _create(self, add, dn, *args):
+        try:
+            add(dn, *args)
+        except ldap.ALREADY_EXISTS:
+            logger.debug("%s exists", dn)
+
+    def bulk_create(self, tenants, window=ldap_client.DEFAULT_WINDOW):
+        """create many tenants in a pipeline, all base entries before their ou entries
+
+        Returns:
+            a list of (dn, error) tuples for the entries failed to create, existing entries excluded
+        """
+        def _entries():
+            tenant_entries = [self.entries(t) for t in tenants]
+            for entries in tenant_entries:
+                yield entries[0]
+            # barrier, the ou entries need their base entry
+            yield None
+            for entries in tenant_entries:
+                for entry in entries[1:]:
+                    yield entry
+
+        failures = self._client.add_entries(_entries(), window=window)
+
+        return [(dn, e) for dn, e in failures if not isinstance(e, ldap.ALREADY_EXISTS)]
+
+
+if __name__ == "__main__":
+    pass